@@ -2,7 +2,8 @@
 # /// script
 # requires-python = ">=3.11"
 # dependencies = [
-#   "duckdb>=1.4.3",
+#   "duckdb>=1.5.0",
+#   "orjson>=3.10",
 #   "polars[pyarrow]>=1.36.1",
 #   "pydantic>=2.0",
 #   "pyyaml>=6.0",
@@ -26,6 +27,11 @@ Usage:
     echo '{"query": "SELECT * FROM '\''data.csv'\''"}' | uv run scripts/query_duckdb.py
     echo '{"query": "SELECT * FROM sales", "sources": [{"type": "file", "alias": "sales", "path": "data.csv"}]}' | uv run scripts/query_duckdb.py
     echo '{"query": "SELECT * FROM db", "secrets_file": "secrets.yaml", "sources": [{"type": "postgres", "alias": "db", "secret": "my_postgres", "table": "users"}]}' | uv run scripts/query_duckdb.py
+
+Daemon mode (--daemon) keeps one connection open and answers one JSON request
+per stdin line with one JSON response line; markdown results are returned as
+{"markdown": "..."}:
+    uv run scripts/query_duckdb.py --daemon < requests.ndjson
 """
 
 from __future__ import annotations
@@ -34,25 +40,98 @@ import json
 import sys
 import os
 import re
+import weakref
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import Optional, Dict, Any, Literal, Union
+from typing import Annotated, Callable, Optional, Dict, Any, Literal, Union
 
 import duckdb
+import orjson
 import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
 import yaml
-from pydantic import BaseModel, Field, model_validator, ConfigDict
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    TypeAdapter,
+    ValidationInfo,
+    model_validator,
+)
+
+# Prefer libyaml's C parser; same safe-loading semantics as yaml.safe_load
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YAMLLoader  # type: ignore[assignment]
 
 DEFAULT_MAX_ROWS = 200
 DEFAULT_MAX_BYTES = 200_000
-
-# Patterns for utility statements that cannot be wrapped in SELECT * FROM (...)
-UTILITY_PATTERNS = [
-    re.compile(r"^\s*DESCRIBE\b", re.IGNORECASE),
-    re.compile(r"^\s*SUMMARIZE\b", re.IGNORECASE),
-    re.compile(r"^\s*SHOW\b", re.IGNORECASE),
-    re.compile(r"^\s*PRAGMA\b", re.IGNORECASE),
-    re.compile(r"^\s*EXPLAIN\b", re.IGNORECASE),
-]
+DEFAULT_THREADS = min(os.cpu_count() or 4, 16)
+DEFAULT_MEMORY_LIMIT = "1GB"
+# Below this many threads, S3 scans tend to stall waiting on requests
+S3_MIN_THREADS = 8
+# With options.check_cardinality, queries are rejected before running when
+# the planner expects a blocking operator (sort, window, hash-join build) to
+# hold more than CARDINALITY_MAX_ROWS rows, and this many times more than
+# any input (cross joins, many-to-many joins)
+CARDINALITY_EXPANSION_FACTOR = 10
+CARDINALITY_MAX_ROWS = 10_000_000
+# Operators that must hold all of their input before producing output
+BLOCKING_OPERATORS = frozenset({"ORDER_BY", "WINDOW"})
+
+# Utility statements that cannot be wrapped in SELECT * FROM (...)
+UTILITY_PATTERN = re.compile(
+    r"^\s*(?:DESCRIBE|SUMMARIZE|SHOW|PRAGMA|EXPLAIN)\b", re.IGNORECASE
+)
+
+# File suffix -> (DuckDB reader function, format name). Compressed text
+# formats are decompressed by DuckDB while streaming.
+FILE_TYPES: Dict[str, tuple[str, str]] = {
+    ".csv": ("read_csv", "csv"),
+    ".tsv": ("read_csv", "csv"),
+    ".parquet": ("read_parquet", "parquet"),
+    ".json": ("read_json", "json"),
+    ".ndjson": ("read_json", "ndjson"),
+    ".jsonl": ("read_json", "ndjson"),
+    ".xlsx": ("read_xlsx", "excel"),
+}
+FILE_TYPES.update({
+    suffix + compression: reader_and_format
+    for suffix, reader_and_format in list(FILE_TYPES.items())
+    if reader_and_format[0] in ("read_csv", "read_json")
+    for compression in (".gz", ".zst")
+})
+# Checked longest first so ".csv.gz" wins over a bare ".gz"
+FILE_SUFFIXES = sorted(FILE_TYPES, key=len, reverse=True)
+
+# A LIMIT clause ending the statement, which bounds the whole result
+TRAILING_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+
+# Extensions already loaded by _ensure_ext, tracked per connection since
+# LOAD is scoped to the database instance
+_LOADED_EXTS: weakref.WeakKeyDictionary[duckdb.DuckDBPyConnection, set[str]] = (
+    weakref.WeakKeyDictionary()
+)
+
+# CREATE SECRET statements already executed, per connection and secret name
+_REGISTERED_SECRETS: weakref.WeakKeyDictionary[
+    duckdb.DuckDBPyConnection, dict[str, str]
+] = weakref.WeakKeyDictionary()
+
+# Connections on which cache_httpfs is loaded and caching in memory
+_HTTPFS_CACHE_ENABLED: weakref.WeakSet[duckdb.DuckDBPyConnection] = weakref.WeakSet()
+
+# Process-wide connection handed out by _get_connection()
+_CONNECTION: Optional[duckdb.DuckDBPyConnection] = None
+
+# Parsed secrets files by path, with the (mtime_ns, size) they were read at
+_YAML_CACHE: Dict[str, tuple[tuple[int, int], Any]] = {}
+
+# Validated secrets configs by (path, trusted), with the expanded data they
+# were built from
+_CONFIG_CACHE: Dict[tuple[str, bool], tuple[Any, "SecretsConfig"]] = {}
 
 # Environment variable pattern for ${VAR_NAME} substitution
 ENV_VAR_PATTERN = re.compile(r"\$\{([^}]+)\}")
@@ -249,6 +328,12 @@ SECRET_TYPE_MAP: Dict[str, type[SecretBase]] = {
     "huggingface": HuggingFaceSecret,
 }
 
+# Tagged-union validator for a single secret, built once at import so Pydantic
+# dispatches on the 'type' field instead of trying each variant in turn.
+_SECRET_ADAPTER: TypeAdapter[AnySecret] = TypeAdapter(
+    Annotated[AnySecret, Field(discriminator="type")]
+)
+
 
 class SecretsConfig(BaseModel):
     """Top-level secrets configuration file structure."""
@@ -258,11 +343,27 @@ class SecretsConfig(BaseModel):
 
     model_config = ConfigDict(extra="forbid")
 
+    @cached_property
+    def secret_sql(self) -> Dict[str, str]:
+        """CREATE SECRET statement per secret name, rendered once per config."""
+        return {
+            name: create_secret_sql(name, secret)
+            for name, secret in self.secrets.items()
+        }
+
     @model_validator(mode="before")
     @classmethod
-    def parse_secret_types(cls, values: Dict[str, Any]) -> Dict[str, Any]:
-        """Parse secrets dict and dispatch to correct model based on 'type' field."""
+    def parse_secret_types(
+        cls, values: Dict[str, Any], info: ValidationInfo
+    ) -> Dict[str, Any]:
+        """
+        Parse secrets dict and dispatch to correct model based on 'type' field.
+
+        When validated with context={"trusted": True}, secrets are built with
+        model_construct() and skip field validation entirely.
+        """
         secrets_raw = values.get("secrets", {})
+        trusted = bool(info.context and info.context.get("trusted"))
         parsed_secrets = {}
 
         for name, secret_data in secrets_raw.items():
@@ -275,11 +376,14 @@ class SecretsConfig(BaseModel):
             if secret_type not in SECRET_TYPE_MAP:
                 raise ValueError(f"Unknown secret type: {secret_type}")
 
-            secret_class = SECRET_TYPE_MAP[secret_type]
-            parsed_secrets[name] = secret_class(**secret_data)
+            if trusted:
+                secret_class = SECRET_TYPE_MAP[secret_type]
+                parsed_secrets[name] = secret_class.model_construct(**secret_data)
+            else:
+                parsed_secrets[name] = _SECRET_ADAPTER.validate_python(secret_data)
 
-        values["secrets"] = parsed_secrets
-        return values
+        # Return a copy rather than mutating values, which may be cached
+        return {**values, "secrets": parsed_secrets}
 
 
 # =============================================================================
@@ -287,204 +391,315 @@ class SecretsConfig(BaseModel):
 # =============================================================================
 
 
+def _expand(value: Any, replace: Callable[[re.Match[str]], str]) -> Any:
+    """Rebuild value with every ${VAR_NAME} in its strings substituted by replace."""
+    if isinstance(value, str):
+        if "${" not in value:
+            return value
+        return ENV_VAR_PATTERN.sub(replace, value)
+    elif isinstance(value, dict):
+        return {k: _expand(v, replace) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_expand(item, replace) for item in value]
+    else:
+        return value
+
+
 def expand_env_vars(value: Any) -> Any:
     """
     Recursively expand ${VAR_NAME} patterns in strings.
 
-    Raises ValueError if referenced env var doesn't exist.
+    Each variable is read from the environment once per call, however many
+    times the config references it.
+
+    Raises ValueError naming every referenced env var that doesn't exist.
     """
-    if isinstance(value, str):
-        matches = ENV_VAR_PATTERN.findall(value)
-        result = value
-        for var_name in matches:
-            env_value = os.environ.get(var_name)
+    env_get = os.environ.get
+    resolved: Dict[str, str] = {}
+    missing: Dict[str, None] = {}
+
+    def replace(match: re.Match[str]) -> str:
+        var_name = match.group(1)
+        env_value = resolved.get(var_name)
+        if env_value is None:
+            env_value = env_get(var_name)
             if env_value is None:
-                raise ValueError(f"Environment variable not set: {var_name}")
-            result = result.replace(f"${{{var_name}}}", env_value)
-        return result
+                missing[var_name] = None
+                return match.group(0)
+            resolved[var_name] = env_value
+        return env_value
+
+    expanded = _expand(value, replace)
+    if missing:
+        raise ValueError(f"Environment variable not set: {', '.join(missing)}")
+    return expanded
+
+
+def _needs_expand(value: Any) -> bool:
+    """Check whether any string nested in value contains a ${VAR_NAME} reference."""
+    if isinstance(value, str):
+        return "${" in value
     elif isinstance(value, dict):
-        return {k: expand_env_vars(v) for k, v in value.items()}
+        return any(_needs_expand(v) for v in value.values())
     elif isinstance(value, list):
-        return [expand_env_vars(item) for item in value]
+        return any(_needs_expand(item) for item in value)
     else:
-        return value
+        return False
+
+
+def _read_yaml(path: Path) -> Any:
+    """
+    Parse a YAML file, reusing the previous parse while the file is unchanged.
+
+    Long-lived processes (daemon mode) load the same secrets file on every
+    request; the cache is keyed on path and invalidated by mtime and size.
+    Callers must treat the returned data as read-only.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Secrets file not found: {path}") from None
+
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    key = str(path)
+    cached = _YAML_CACHE.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    data = yaml.load(path.read_bytes(), Loader=YAMLLoader)
+    _YAML_CACHE[key] = (stamp, data)
+    return data
+
+
+def _clear_cache() -> None:
+    """Drop all cached secrets file parses and validated configs."""
+    _YAML_CACHE.clear()
+    _CONFIG_CACHE.clear()
 
 
-def load_secrets_from_yaml(file_path: str) -> SecretsConfig:
+def load_secrets_from_yaml(file_path: str, trusted: bool = False) -> SecretsConfig:
     """
     Load and validate secrets from a YAML file using Pydantic.
 
     Supports environment variable substitution with ${VAR_NAME} syntax.
 
+    Set trusted=True for local config whose contents are known to be valid;
+    secret models are then constructed without per-field validation.
+
+    A config is only validated again when the expanded data differs from
+    the previous load of the same file, so the returned config is shared
+    between callers and must be treated as read-only.
+
     Raises:
         FileNotFoundError: If secrets file doesn't exist
         yaml.YAMLError: If YAML is malformed
         ValidationError: If secrets don't match schema
     """
     path = Path(file_path)
-    if not path.exists():
-        raise FileNotFoundError(f"Secrets file not found: {file_path}")
-
-    with open(path, "r", encoding="utf-8") as f:
-        raw_data = yaml.safe_load(f)
+    raw_data = _read_yaml(path)
 
     if raw_data is None:
         raise ValueError("Secrets file is empty")
 
-    # Expand environment variables
-    expanded_data = expand_env_vars(raw_data)
+    # Expand environment variables; most configs have none, so skip
+    # rebuilding the whole tree when no string references one
+    expanded_data = expand_env_vars(raw_data) if _needs_expand(raw_data) else raw_data
 
-    # Parse and validate with Pydantic
-    return SecretsConfig(**expanded_data)
+    # Reuse the previous config while the file and the environment variables
+    # it references are unchanged
+    key = (str(path), trusted)
+    cached = _CONFIG_CACHE.get(key)
+    if cached is not None and cached[0] == expanded_data:
+        return cached[1]
 
+    # Parse and validate with Pydantic
+    config = SecretsConfig.model_validate(expanded_data, context={"trusted": trusted})
+    _CONFIG_CACHE[key] = (expanded_data, config)
+    return config
+
+
+def _postgres_secret_sql(secret: PostgresSecret) -> str:
+    """Build the CREATE SECRET option list for PostgreSQL."""
+    # Build libpq connection string
+    conn_str = (
+        f"host={secret.host} port={secret.port} "
+        f"user={secret.user} password={secret.password} "
+        f"dbname={secret.database}"
+    )
+    return f"TYPE postgres, CONNECTION_STRING {escape_string(conn_str)}"
 
-def create_secret_sql(secret_name: str, secret: AnySecret) -> str:
-    """Generate CREATE OR REPLACE SECRET SQL for a Pydantic secret model."""
-    escaped_name = escape_identifier(secret_name)
 
-    if isinstance(secret, PostgresSecret):
-        # Build libpq connection string
-        conn_str = (
-            f"host={secret.host} port={secret.port} "
-            f"user={secret.user} password={secret.password} "
-            f"dbname={secret.database}"
+def _mysql_secret_sql(secret: MySQLSecret) -> str:
+    """Build the CREATE SECRET option list for MySQL."""
+    # MySQL uses a similar connection string format
+    conn_str = (
+        f"host={secret.host} port={secret.port} "
+        f"user={secret.user} password={secret.password} "
+        f"database={secret.database}"
+    )
+    return f"TYPE mysql, CONNECTION_STRING {escape_string(conn_str)}"
+
+
+def _s3_secret_sql(secret: S3Secret) -> str:
+    """Build the CREATE SECRET option list for S3."""
+    parts = [
+        "TYPE s3",
+        f"KEY_ID {escape_string(secret.key_id)}",
+        f"SECRET {escape_string(secret.secret)}",
+        f"REGION {escape_string(secret.region)}",
+    ]
+    if secret.endpoint:
+        parts.append(f"ENDPOINT {escape_string(secret.endpoint)}")
+    if not secret.use_ssl:
+        parts.append("USE_SSL false")
+    if secret.scope:
+        parts.append(f"SCOPE {escape_string(secret.scope)}")
+    return ", ".join(parts)
+
+
+def _gcs_secret_sql(secret: GCSSecret) -> str:
+    """Build the CREATE SECRET option list for GCS."""
+    parts = [
+        "TYPE gcs",
+        f"KEY_ID {escape_string(secret.key_id)}",
+        f"SECRET {escape_string(secret.secret)}",
+    ]
+    if secret.region:
+        parts.append(f"REGION {escape_string(secret.region)}")
+    if secret.scope:
+        parts.append(f"SCOPE {escape_string(secret.scope)}")
+    return ", ".join(parts)
+
+
+def _azure_secret_sql(secret: AzureSecret) -> str:
+    """Build the CREATE SECRET option list for Azure."""
+    parts = ["TYPE azure"]
+    if secret.provider:
+        parts.append(f"PROVIDER {secret.provider}")
+    if secret.account_name:
+        parts.append(f"ACCOUNT_NAME {escape_string(secret.account_name)}")
+    if secret.account_key:
+        parts.append(f"ACCOUNT_KEY {escape_string(secret.account_key)}")
+    if secret.connection_string:
+        parts.append(f"CONNECTION_STRING {escape_string(secret.connection_string)}")
+    if secret.tenant_id:
+        parts.append(f"TENANT_ID {escape_string(secret.tenant_id)}")
+    if secret.client_id:
+        parts.append(f"CLIENT_ID {escape_string(secret.client_id)}")
+    if secret.client_secret:
+        parts.append(f"CLIENT_SECRET {escape_string(secret.client_secret)}")
+    if secret.client_certificate_path:
+        parts.append(
+            f"CLIENT_CERTIFICATE_PATH {escape_string(secret.client_certificate_path)}"
         )
-        return f"CREATE OR REPLACE SECRET {escaped_name} (TYPE postgres, CONNECTION_STRING {escape_string(conn_str)})"
-
-    elif isinstance(secret, MySQLSecret):
-        # MySQL uses a similar connection string format
-        conn_str = (
-            f"host={secret.host} port={secret.port} "
-            f"user={secret.user} password={secret.password} "
-            f"database={secret.database}"
+    if secret.chain:
+        parts.append(f"CHAIN {escape_string(secret.chain)}")
+    return ", ".join(parts)
+
+
+def _r2_secret_sql(secret: R2Secret) -> str:
+    """Build the CREATE SECRET option list for R2."""
+    parts = [
+        "TYPE r2",
+        f"KEY_ID {escape_string(secret.key_id)}",
+        f"SECRET {escape_string(secret.secret)}",
+        f"ACCOUNT_ID {escape_string(secret.account_id)}",
+    ]
+    if secret.region:
+        parts.append(f"REGION {escape_string(secret.region)}")
+    if secret.scope:
+        parts.append(f"SCOPE {escape_string(secret.scope)}")
+    return ", ".join(parts)
+
+
+def _http_secret_sql(secret: HTTPSecret) -> str:
+    """Build the CREATE SECRET option list for HTTP."""
+    parts = ["TYPE http"]
+    if secret.bearer_token:
+        parts.append(f"BEARER_TOKEN {escape_string(secret.bearer_token)}")
+    if secret.extra_http_headers:
+        # Format as MAP for DuckDB
+        headers_str = ", ".join(
+            f"{escape_string(k)}: {escape_string(v)}"
+            for k, v in secret.extra_http_headers.items()
         )
-        return f"CREATE OR REPLACE SECRET {escaped_name} (TYPE mysql, CONNECTION_STRING {escape_string(conn_str)})"
-
-    elif isinstance(secret, S3Secret):
-        parts = [
-            "TYPE s3",
-            f"KEY_ID {escape_string(secret.key_id)}",
-            f"SECRET {escape_string(secret.secret)}",
-            f"REGION {escape_string(secret.region)}",
-        ]
-        if secret.endpoint:
-            parts.append(f"ENDPOINT {escape_string(secret.endpoint)}")
-        if not secret.use_ssl:
-            parts.append("USE_SSL false")
-        if secret.scope:
-            parts.append(f"SCOPE {escape_string(secret.scope)}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
-
-    elif isinstance(secret, GCSSecret):
-        parts = [
-            "TYPE gcs",
-            f"KEY_ID {escape_string(secret.key_id)}",
-            f"SECRET {escape_string(secret.secret)}",
-        ]
-        if secret.region:
-            parts.append(f"REGION {escape_string(secret.region)}")
-        if secret.scope:
-            parts.append(f"SCOPE {escape_string(secret.scope)}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
-
-    elif isinstance(secret, AzureSecret):
-        parts = ["TYPE azure"]
-        if secret.provider:
-            parts.append(f"PROVIDER {secret.provider}")
-        if secret.account_name:
-            parts.append(f"ACCOUNT_NAME {escape_string(secret.account_name)}")
-        if secret.account_key:
-            parts.append(f"ACCOUNT_KEY {escape_string(secret.account_key)}")
-        if secret.connection_string:
-            parts.append(f"CONNECTION_STRING {escape_string(secret.connection_string)}")
-        if secret.tenant_id:
-            parts.append(f"TENANT_ID {escape_string(secret.tenant_id)}")
-        if secret.client_id:
-            parts.append(f"CLIENT_ID {escape_string(secret.client_id)}")
-        if secret.client_secret:
-            parts.append(f"CLIENT_SECRET {escape_string(secret.client_secret)}")
-        if secret.client_certificate_path:
-            parts.append(
-                f"CLIENT_CERTIFICATE_PATH {escape_string(secret.client_certificate_path)}"
-            )
-        if secret.chain:
-            parts.append(f"CHAIN {escape_string(secret.chain)}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
-
-    elif isinstance(secret, R2Secret):
-        parts = [
-            "TYPE r2",
-            f"KEY_ID {escape_string(secret.key_id)}",
-            f"SECRET {escape_string(secret.secret)}",
-            f"ACCOUNT_ID {escape_string(secret.account_id)}",
-        ]
-        if secret.region:
-            parts.append(f"REGION {escape_string(secret.region)}")
-        if secret.scope:
-            parts.append(f"SCOPE {escape_string(secret.scope)}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
-
-    elif isinstance(secret, HTTPSecret):
-        parts = ["TYPE http"]
-        if secret.bearer_token:
-            parts.append(f"BEARER_TOKEN {escape_string(secret.bearer_token)}")
-        if secret.extra_http_headers:
-            # Format as MAP for DuckDB
-            headers_str = ", ".join(
-                f"{escape_string(k)}: {escape_string(v)}"
-                for k, v in secret.extra_http_headers.items()
-            )
-            parts.append(f"EXTRA_HTTP_HEADERS MAP {{{headers_str}}}")
-        if secret.http_proxy:
-            parts.append(f"HTTP_PROXY {escape_string(secret.http_proxy)}")
-        if secret.http_proxy_username:
-            parts.append(
-                f"HTTP_PROXY_USERNAME {escape_string(secret.http_proxy_username)}"
-            )
-        if secret.http_proxy_password:
-            parts.append(
-                f"HTTP_PROXY_PASSWORD {escape_string(secret.http_proxy_password)}"
-            )
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
-
-    elif isinstance(secret, IcebergSecret):
-        parts = ["TYPE iceberg"]
-        if secret.token:
-            parts.append(f"TOKEN {escape_string(secret.token)}")
-        if secret.client_id:
-            parts.append(f"CLIENT_ID {escape_string(secret.client_id)}")
-        if secret.client_secret:
-            parts.append(f"CLIENT_SECRET {escape_string(secret.client_secret)}")
-        if secret.oauth2_server_uri:
-            parts.append(f"OAUTH2_SERVER_URI {escape_string(secret.oauth2_server_uri)}")
-        if secret.oauth2_scope:
-            parts.append(f"OAUTH2_SCOPE {escape_string(secret.oauth2_scope)}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
-
-    elif isinstance(secret, DuckLakeSecret):
-        parts = [
-            "TYPE ducklake",
-            f"METADATA_PATH {escape_string(secret.metadata_path)}",
-            f"DATA_PATH {escape_string(secret.data_path)}",
-        ]
-        if secret.metadata_parameters:
-            params_str = ", ".join(
-                f"{escape_string(k)}: {escape_string(v)}"
-                for k, v in secret.metadata_parameters.items()
-            )
-            parts.append(f"METADATA_PARAMETERS MAP {{{params_str}}}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
+        parts.append(f"EXTRA_HTTP_HEADERS MAP {{{headers_str}}}")
+    if secret.http_proxy:
+        parts.append(f"HTTP_PROXY {escape_string(secret.http_proxy)}")
+    if secret.http_proxy_username:
+        parts.append(
+            f"HTTP_PROXY_USERNAME {escape_string(secret.http_proxy_username)}"
+        )
+    if secret.http_proxy_password:
+        parts.append(
+            f"HTTP_PROXY_PASSWORD {escape_string(secret.http_proxy_password)}"
+        )
+    return ", ".join(parts)
+
+
+def _iceberg_secret_sql(secret: IcebergSecret) -> str:
+    """Build the CREATE SECRET option list for Iceberg."""
+    parts = ["TYPE iceberg"]
+    if secret.token:
+        parts.append(f"TOKEN {escape_string(secret.token)}")
+    if secret.client_id:
+        parts.append(f"CLIENT_ID {escape_string(secret.client_id)}")
+    if secret.client_secret:
+        parts.append(f"CLIENT_SECRET {escape_string(secret.client_secret)}")
+    if secret.oauth2_server_uri:
+        parts.append(f"OAUTH2_SERVER_URI {escape_string(secret.oauth2_server_uri)}")
+    if secret.oauth2_scope:
+        parts.append(f"OAUTH2_SCOPE {escape_string(secret.oauth2_scope)}")
+    return ", ".join(parts)
+
+
+def _ducklake_secret_sql(secret: DuckLakeSecret) -> str:
+    """Build the CREATE SECRET option list for DuckLake."""
+    parts = [
+        "TYPE ducklake",
+        f"METADATA_PATH {escape_string(secret.metadata_path)}",
+        f"DATA_PATH {escape_string(secret.data_path)}",
+    ]
+    if secret.metadata_parameters:
+        params_str = ", ".join(
+            f"{escape_string(k)}: {escape_string(v)}"
+            for k, v in secret.metadata_parameters.items()
+        )
+        parts.append(f"METADATA_PARAMETERS MAP {{{params_str}}}")
+    return ", ".join(parts)
+
+
+def _huggingface_secret_sql(secret: HuggingFaceSecret) -> str:
+    """Build the CREATE SECRET option list for HuggingFace."""
+    parts = ["TYPE huggingface"]
+    if secret.provider:
+        parts.append(f"PROVIDER {secret.provider}")
+    if secret.token:
+        parts.append(f"TOKEN {escape_string(secret.token)}")
+    return ", ".join(parts)
+
+
+# Map secret class to the builder for its CREATE SECRET option list
+SECRET_SQL_BUILDERS: Dict[type[SecretBase], Callable[[Any], str]] = {
+    PostgresSecret: _postgres_secret_sql,
+    MySQLSecret: _mysql_secret_sql,
+    S3Secret: _s3_secret_sql,
+    GCSSecret: _gcs_secret_sql,
+    AzureSecret: _azure_secret_sql,
+    R2Secret: _r2_secret_sql,
+    HTTPSecret: _http_secret_sql,
+    IcebergSecret: _iceberg_secret_sql,
+    DuckLakeSecret: _ducklake_secret_sql,
+    HuggingFaceSecret: _huggingface_secret_sql,
+}
 
-    elif isinstance(secret, HuggingFaceSecret):
-        parts = ["TYPE huggingface"]
-        if secret.provider:
-            parts.append(f"PROVIDER {secret.provider}")
-        if secret.token:
-            parts.append(f"TOKEN {escape_string(secret.token)}")
-        return f"CREATE OR REPLACE SECRET {escaped_name} ({', '.join(parts)})"
 
-    else:
+def create_secret_sql(secret_name: str, secret: AnySecret) -> str:
+    """Generate CREATE OR REPLACE SECRET SQL for a Pydantic secret model."""
+    builder = SECRET_SQL_BUILDERS.get(type(secret))
+    if builder is None:
         raise ValueError(f"Unknown secret type: {type(secret)}")
+    return f"CREATE OR REPLACE SECRET {escape_identifier(secret_name)} ({builder(secret)})"
 
 
 def register_duckdb_secret(
@@ -495,12 +710,28 @@ def register_duckdb_secret(
     con.execute(sql)
 
 
+def _pending_secret_sql(
+    con: duckdb.DuckDBPyConnection, secrets_config: SecretsConfig
+) -> Dict[str, str]:
+    """
+    Return CREATE SECRET statements not yet executed on this connection.
+
+    Secrets already registered with identical SQL are skipped, so a
+    long-lived connection doesn't re-create them per request.
+    """
+    registered = _REGISTERED_SECRETS.get(con, {})
+    return {
+        name: sql
+        for name, sql in secrets_config.secret_sql.items()
+        if registered.get(name) != sql
+    }
+
+
 def register_all_secrets(
     con: duckdb.DuckDBPyConnection, secrets_config: SecretsConfig
 ) -> None:
     """Register all secrets from a SecretsConfig in DuckDB."""
-    for name, secret in secrets_config.secrets.items():
-        register_duckdb_secret(con, name, secret)
+    setup_connection(con, [], secrets_config)
 
 
 # =============================================================================
@@ -509,11 +740,16 @@ def register_all_secrets(
 
 
 def write_output(
-    con: duckdb.DuckDBPyConnection, query: str, output: OutputConfig
+    con: duckdb.DuckDBPyConnection,
+    query: str,
+    output: OutputConfig,
+    params: Optional[list] = None,
 ) -> dict:
     """
     Execute query and write results to file using COPY TO.
 
+    params are bound to '?' placeholders in query.
+
     Returns metadata about the write operation including rows_written,
     files_created, and total_size_bytes.
     """
@@ -524,7 +760,9 @@ def write_output(
     format_str = output.format.upper()
 
     # Count rows before writing (for verification)
-    count_result = con.execute(f"SELECT COUNT(*) FROM ({query}) AS _count_q").fetchone()
+    count_result = con.execute(
+        f"SELECT COUNT(*) FROM ({query}) AS _count_q", params
+    ).fetchone()
     rows_written = count_result[0] if count_result else 0
 
     # Check for overwrite protection (for non-partitioned writes)
@@ -561,21 +799,28 @@ def write_output(
         else:
             copy_opts.append("ARRAY false")
 
-    # Partitioning (works for all formats)
+    # Partitioning (works for all formats). A plain directory target gets
+    # one file per thread instead, so the writes run in parallel; DuckDB
+    # can't combine the two.
+    per_thread = False
     if opts.partition_by:
         cols = ", ".join(opts.partition_by)
         copy_opts.append(f"PARTITION_BY ({cols})")
+    elif output.path.endswith(("/", "\\")) or path.is_dir():
+        per_thread = True
+        copy_opts.append("PER_THREAD_OUTPUT true")
 
-    # Overwrite handling
+    # Overwrite handling. Per-thread file names depend on the thread count,
+    # so clear the directory rather than leave stale files from a prior run.
     if opts.overwrite:
-        copy_opts.append("OVERWRITE_OR_IGNORE true")
+        copy_opts.append("OVERWRITE true" if per_thread else "OVERWRITE_OR_IGNORE true")
 
     # Build and execute COPY TO
     opts_str = ", ".join(copy_opts)
     escaped_path = escape_string(output.path)
     copy_sql = f"COPY ({query}) TO {escaped_path} ({opts_str})"
 
-    con.execute(copy_sql)
+    con.execute(copy_sql, params)
 
     duration_ms = int((time.time() - start_time) * 1000)
 
@@ -588,9 +833,10 @@ def write_output(
         files_created = [output.path]
         total_size_bytes = path.stat().st_size
     elif path.is_dir() or opts.partition_by:
-        # Partitioned output - list all created files
+        # Partitioned output - list all created files, including compressed
+        # ones such as data_0.csv.gz
         ext = output.format if output.format != "json" else "json"
-        files = list(path.rglob(f"*.{ext}"))
+        files = [f for f in path.rglob(f"*.{ext}*") if f.is_file()]
         files_created = [str(f) for f in sorted(files)]
         total_size_bytes = sum(f.stat().st_size for f in files)
 
@@ -614,18 +860,27 @@ def write_output(
 # =============================================================================
 
 
+def detect_reader(path: str) -> tuple[Optional[str], str]:
+    """
+    Detect the DuckDB reader for a file path, glob or URL.
+
+    Returns:
+        (reader, ext): reader function name (None if unsupported) and the
+        matched suffix, e.g. ("read_csv", ".csv.gz")
+    """
+    if "://" in path:
+        path = path.split("?", 1)[0]  # drop URL query strings (signed URLs)
+    clean_path = path.rstrip("*/").lower()
+    for suffix in FILE_SUFFIXES:
+        if clean_path.endswith(suffix):
+            return FILE_TYPES[suffix][0], suffix
+    return None, os.path.splitext(clean_path)[1]
+
+
 def detect_format(path: str) -> str:
     """Detect file format from extension."""
-    ext = Path(path).suffix.lower()
-    format_map = {
-        ".csv": "csv",
-        ".tsv": "csv",
-        ".parquet": "parquet",
-        ".json": "json",
-        ".ndjson": "ndjson",
-        ".xlsx": "excel",
-    }
-    return format_map.get(ext, "unknown")
+    reader, ext = detect_reader(path)
+    return FILE_TYPES[ext][1] if reader else "unknown"
 
 
 def explore_data(
@@ -688,57 +943,497 @@ def explore_data(
     result["columns"] = columns
 
     # 4. Get sample rows formatted as markdown
-    sample_df = con.execute(f"SELECT * FROM {target} LIMIT {sample_rows}").pl()
+    sample = fetch_arrow(con.sql(f"SELECT * FROM {target}"), sample_rows)
+    result["sample"] = arrow_to_markdown(sample)
+
+    return result
+
+
+# =============================================================================
+# Utility Functions
+# =============================================================================
+
+
+def connect(
+    threads: int = DEFAULT_THREADS, memory_limit: str = DEFAULT_MEMORY_LIMIT
+) -> duckdb.DuckDBPyConnection:
+    """Open an in-memory DuckDB connection with resource limits and caches set."""
+    con = duckdb.connect(database=":memory:")
+    # Reuse file data and Parquet metadata across scans of the same files
+    con.execute(
+        f"{resource_limits_sql(threads, memory_limit)};"
+        "SET enable_external_file_cache=true;"
+        "SET enable_object_cache=true;"
+    )
+    return con
+
+
+def resource_limits_sql(threads: int, memory_limit: str) -> str:
+    """Build the statements that set DuckDB's thread count and memory limit."""
+    return (
+        f"PRAGMA threads={int(threads)};"
+        f"PRAGMA memory_limit={escape_string(str(memory_limit))}"
+    )
+
+
+def _get_connection() -> duckdb.DuckDBPyConnection:
+    """Return the process-wide connection, opening it on first use."""
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = connect()
+    return _CONNECTION
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize a response object to UTF-8 JSON bytes."""
+    try:
+        return orjson.dumps(obj, default=str)
+    except orjson.JSONEncodeError:
+        # orjson rejects integers beyond 64 bits (e.g. HUGEINT sums)
+        return json.dumps(obj, default=str).encode("utf-8")
+
+
+def fetch_arrow(
+    res: Union[duckdb.DuckDBPyConnection, duckdb.DuckDBPyRelation], limit: int
+) -> pa.Table:
+    """Read at most `limit` rows of a pending result as an Arrow table."""
+    if limit <= 0:
+        # DuckDB rejects a zero batch size; the schema is all that's needed
+        return res.to_arrow_reader().schema.empty_table()
+    reader = res.to_arrow_reader(limit)
+    batches = []
+    num_rows = 0
+    for batch in reader:
+        batches.append(batch)
+        num_rows += batch.num_rows
+        if num_rows >= limit:
+            break
+    return pa.Table.from_batches(batches, schema=reader.schema).slice(0, limit)
+
+
+def _dedupe_columns(arrow_tbl: pa.Table) -> pa.Table:
+    """
+    Rename repeated column names the way DuckDB does for subqueries.
+
+    SELECT * over a join returns both sides' key columns under the same name;
+    the second becomes name_1, the next name_2 and so on, compared
+    case-insensitively. Output formats keyed by column name would otherwise
+    drop or reject the repeats.
+    """
+    names = arrow_tbl.column_names
+    if len({name.lower() for name in names}) == len(names):
+        return arrow_tbl
+
+    # Next suffix to try, per lower-cased name already in use
+    next_suffix: Dict[str, int] = {}
+    renamed = []
+    for name in names:
+        key = name.lower()
+        if key in next_suffix:
+            suffix = next_suffix[key]
+            while f"{key}_{suffix}" in next_suffix:
+                suffix += 1
+            next_suffix[key] = suffix + 1
+            name = f"{name}_{suffix}"
+            key = name.lower()
+        next_suffix[key] = 1
+        renamed.append(name)
+    return arrow_tbl.rename_columns(renamed)
+
+
+def _needs_python_json(dtype: pa.DataType) -> bool:
+    """Check if a type, or any type nested in it, is binary, temporal or an interval."""
+    if (
+        pa.types.is_interval(dtype)
+        or pa.types.is_binary(dtype)
+        or pa.types.is_large_binary(dtype)
+        or pa.types.is_fixed_size_binary(dtype)
+        or pa.types.is_binary_view(dtype)
+        or pa.types.is_timestamp(dtype)
+        or pa.types.is_time(dtype)
+    ):
+        return True
+    return any(
+        _needs_python_json(dtype.field(i).type) for i in range(dtype.num_fields)
+    )
+
+
+def _native_json_ok(arrow_tbl: pa.Table) -> bool:
+    """
+    Check if Polars' JSON writer encodes every column the way orjson does.
+
+    Polars can't import intervals or write binary values, and writes
+    timestamps as "2024-01-01 10:00:00" where orjson writes ISO 8601
+    "2024-01-01T10:00:00". Tables holding any of these are encoded from
+    Python values instead, so all JSON output formats agree.
+    """
+    return not any(_needs_python_json(field.type) for field in arrow_tbl.schema)
+
+
+def _python_records(arrow_tbl: pa.Table) -> list[dict]:
+    """Convert rows to dicts of Python values for orjson to encode."""
+    try:
+        return pl.from_arrow(arrow_tbl, rechunk=False).to_dicts()
+    except pl.exceptions.ComputeError:
+        # Types Polars can't import (intervals)
+        return arrow_tbl.to_pylist()
+
+
+def records_json(arrow_tbl: pa.Table) -> Any:
+    """
+    Encode rows as a JSON array of objects for embedding in a response.
+
+    Uses Polars' native JSON writer and returns a pre-serialized fragment, so
+    cell values never become Python objects. Types the writer doesn't encode
+    like orjson fall back to Python records.
+    """
+    if _native_json_ok(arrow_tbl):
+        return orjson.Fragment(pl.from_arrow(arrow_tbl, rechunk=False).write_json())
+    return _python_records(arrow_tbl)
+
+
+def records_output(arrow_tbl: pa.Table) -> Dict[str, Any]:
+    """Format rows as a list of dicts (JSON records)."""
+    return {"data": records_json(arrow_tbl)}
+
+
+def csv_output(arrow_tbl: pa.Table) -> Dict[str, Any]:
+    """Format rows as a CSV string."""
+    return {"csv": pl.from_arrow(arrow_tbl, rechunk=False).write_csv()}
+
+
+def json_output(arrow_tbl: pa.Table) -> Dict[str, Any]:
+    """Format rows as a column schema plus row arrays."""
+    df = pl.from_arrow(arrow_tbl, rechunk=False)
+    schema = [{"name": col, "type": str(dtype)} for col, dtype in zip(df.columns, df.dtypes)]
+    return {"schema": schema, "rows": df.rows()}
+
+
+# Response body builders for the JSON output formats; markdown is plain text
+OUTPUT_FORMATTERS: Dict[str, Callable[[pa.Table], Dict[str, Any]]] = {
+    "records": records_output,
+    "csv": csv_output,
+    "json": json_output,
+}
+
+
+def _row_fragments(arrow_tbl: pa.Table, output_format: str) -> list[bytes]:
+    """
+    Encode each row separately, exactly as it appears in a records/json response.
+
+    Used when trimming to max_bytes, so a prefix of rows can be joined
+    without serializing the whole payload again.
+    """
+    if output_format == "records":
+        if _native_json_ok(arrow_tbl):
+            ndjson = pl.from_arrow(arrow_tbl, rechunk=False).write_ndjson()
+            # Split on "\n" only: the writer escapes newlines but not other
+            # characters str.splitlines() would break on
+            return [line.encode("utf-8") for line in ndjson.split("\n") if line]
+        return [_dumps(record) for record in _python_records(arrow_tbl)]
+    return [_dumps(row) for row in pl.from_arrow(arrow_tbl, rechunk=False).rows()]
+
+
+def _fit_row_fragments(
+    out_obj: Dict[str, Any], key: str, fragments: list[bytes], max_bytes: int
+) -> bytes:
+    """Encode out_obj with the longest prefix of row fragments under max_bytes."""
+    out_obj[key] = []
+    budget = max_bytes - len(_dumps(out_obj))
+    size = 0
+    count = 0
+    for fragment in fragments:
+        # Each row after the first also costs a separating comma
+        size += len(fragment) + (1 if count else 0)
+        if size > budget:
+            break
+        count += 1
+    out_obj[key] = orjson.Fragment(b"[" + b",".join(fragments[:count]) + b"]")
+    return _dumps(out_obj)
+
+
+def _markdown_cell(value: Any) -> str:
+    """Render a single value the way Polars prints it in a markdown table."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).replace("\n", " ")
+
+
+def _is_text_type(dtype: pa.DataType) -> bool:
+    """Check if an Arrow type holds UTF-8 strings."""
+    return (
+        pa.types.is_string(dtype)
+        or pa.types.is_large_string(dtype)
+        or pa.types.is_string_view(dtype)
+    )
+
+
+def _polars_cells(col: pa.ChunkedArray) -> Optional[list[str]]:
+    """
+    Render a column's cells with Polars' own table formatter.
+
+    Returns None when Polars can't import the type, or a cell spans several
+    lines and can't be told apart from the next row.
+    """
+    try:
+        df = pl.from_arrow(pa.table({"_": col}), rechunk=False)
+    except pl.exceptions.ComputeError:
+        return None
     with pl.Config(
         tbl_formatting="MARKDOWN",
         tbl_hide_dataframe_shape=True,
         tbl_hide_column_data_types=True,
         set_tbl_width_chars=1000,
+        tbl_rows=-1,
     ):
-        result["sample"] = str(sample_df)
+        # Skip the header and separator rows; strip the "| " ... " |" frame
+        lines = str(df).splitlines()[2:]
+    if len(lines) != len(col):
+        return None
+    return [line[1:-1].strip() for line in lines]
 
-    return result
 
+def _markdown_column(col: pa.ChunkedArray) -> list[str]:
+    """
+    Render a column's cells as markdown strings.
 
-# =============================================================================
-# Utility Functions
-# =============================================================================
+    Types whose Arrow string cast matches the Polars rendering are formatted
+    in Arrow compute kernels. Everything else (floats, timestamps, nested
+    values) is formatted by Polars one column at a time, so it reads exactly
+    as in a Polars table; types Polars can't handle go through Python's str().
+    """
+    dtype = col.type
+    if (
+        _is_text_type(dtype)
+        or pa.types.is_integer(dtype)
+        or pa.types.is_boolean(dtype)
+        or pa.types.is_date(dtype)
+    ):
+        text = pc.cast(col, pa.string())
+        if _is_text_type(dtype):
+            text = pc.replace_substring(text, "\n", " ")
+        return pc.fill_null(text, "null").to_pylist()
+    cells = _polars_cells(col)
+    if cells is not None:
+        return cells
+    return [_markdown_cell(v) for v in col.to_pylist()]
+
+
+def arrow_to_markdown(arrow_tbl: pa.Table) -> str:
+    """
+    Render an Arrow table as a markdown table.
+
+    Each column is converted to strings once and padded to its widest cell,
+    so small result previews don't pay for building a Polars DataFrame.
+    Unlike Polars, long strings are shown in full and newlines inside text
+    cells become spaces, so every row stays on one line.
+    """
+    names = arrow_tbl.column_names
+    columns = [_markdown_column(col) for col in arrow_tbl.columns]
+    widths = [
+        max([len(name), 1, *(len(cell) for cell in cells)])
+        for name, cells in zip(names, columns)
+    ]
+
+    lines = [
+        "| " + " | ".join(f"{n:<{w}}" for n, w in zip(names, widths)) + " |",
+        "|" + "|".join("-" * (w + 2) for w in widths) + "|",
+    ]
+    for row in zip(*columns):
+        lines.append(
+            "| " + " | ".join(f"{v:<{w}}" for v, w in zip(row, widths)) + " |"
+        )
+    return "\n".join(lines)
+
+
+def _ensure_ext(con: duckdb.DuckDBPyConnection, name: str) -> None:
+    """Load a DuckDB extension at most once per connection, installing if needed."""
+    loaded = _LOADED_EXTS.setdefault(con, set())
+    if name in loaded:
+        return
+    try:
+        con.execute(f"LOAD {name};")
+    except duckdb.Error:
+        # Not installed locally yet; INSTALL may hit the network
+        con.execute(f"INSTALL {name}; LOAD {name};")
+    loaded.add(name)
+
+
+def _enable_httpfs_cache(con: duckdb.DuckDBPyConnection) -> None:
+    """
+    Cache remote reads in memory with the community cache_httpfs extension.
+
+    Repeated scans of the same S3 objects then hit RAM instead of the
+    network. The extension caches on disk by default, so if in-memory mode
+    can't be set, caching is switched off and the request fails rather
+    than writing remote data to local disk.
+    """
+    if con in _HTTPFS_CACHE_ENABLED:
+        return
+    try:
+        con.execute("LOAD cache_httpfs;")
+    except duckdb.Error:
+        # Not installed locally yet; INSTALL hits the network
+        con.execute("INSTALL cache_httpfs FROM community; LOAD cache_httpfs;")
+    try:
+        con.execute("SET cache_httpfs_type='in_mem';")
+    except duckdb.Error as e:
+        # The extension can't be unloaded; stop it caching at all instead
+        con.execute("SET cache_httpfs_type='noop';")
+        raise ValueError(f"Could not enable in-memory httpfs caching: {e}") from e
+    _HTTPFS_CACHE_ENABLED.add(con)
+
+
+def _ensure_exts(
+    con: duckdb.DuckDBPyConnection, names: list[str], cache_httpfs: bool = False
+) -> None:
+    """Load the extensions a source needs, plus remote read caching if requested."""
+    for name in names:
+        _ensure_ext(con, name)
+    if cache_httpfs and "httpfs" in names:
+        _enable_httpfs_cache(con)
 
 
 def is_utility_statement(query: str) -> bool:
     """Check if query is a utility statement that shouldn't be wrapped."""
-    return any(pattern.match(query) for pattern in UTILITY_PATTERNS)
+    return UTILITY_PATTERN.match(query) is not None
+
+
+def has_row_limit(query: str, max_rows: int) -> bool:
+    """Check if query already ends in a LIMIT no larger than max_rows."""
+    match = TRAILING_LIMIT_PATTERN.search(query)
+    return match is not None and int(match.group(1)) <= max_rows
+
 
+def _plan_rows(node: dict) -> tuple[int, int, int]:
+    """
+    Walk an EXPLAIN (FORMAT json) subtree.
+
+    Inputs that are streamed (into aggregates, limits, a hash join's probe
+    side or the result) don't count towards the blocked estimate, since they
+    never have to be held in memory at once.
+
+    Returns:
+        (rows, largest_input, largest_blocked): the node's row estimate, the
+        biggest leaf (scan) estimate, and the biggest estimate feeding a
+        blocking operator in the subtree
+    """
+    children = [_plan_rows(child) for child in node.get("children") or []]
+    extra_info = node.get("extra_info")
+    estimate = (
+        extra_info.get("Estimated Cardinality") if isinstance(extra_info, dict) else None
+    )
+    if isinstance(estimate, str) and estimate.isdigit():
+        rows = int(estimate)
+    elif node.get("name") == "CROSS_PRODUCT" and children:
+        # The planner leaves cross products unestimated
+        rows = 1
+        for child_rows, _, _ in children:
+            rows *= child_rows
+    else:
+        rows = max((child[0] for child in children), default=0)
+
+    if not children:
+        return rows, rows, 0
+    largest_input = max(child[1] for child in children)
+    largest_blocked = max(child[2] for child in children)
+    name = node.get("name")
+    if name in BLOCKING_OPERATORS:
+        largest_blocked = max(largest_blocked, *(child[0] for child in children))
+    elif name == "HASH_JOIN" and len(children) > 1:
+        # The right child is the side built into the hash table
+        largest_blocked = max(largest_blocked, children[1][0])
+    return rows, largest_input, largest_blocked
+
+
+def estimate_cardinality(
+    con: duckdb.DuckDBPyConnection, query: str, params: Optional[list] = None
+) -> tuple[int, int]:
+    """
+    Read row estimates from the query plan without executing it.
 
+    Returns:
+        (largest_input, largest_blocked): the biggest estimate among leaf
+        operators (scans) and among inputs to blocking operators
+    """
+    if len(con.extract_statements(query)) != 1:
+        # EXPLAIN would only cover the first statement and run the rest
+        return 0, 0
+    explained = con.execute(f"EXPLAIN (FORMAT json) {query}", params).fetchone()
+    if explained is None:
+        return 0, 0
+    largest_input = largest_blocked = 0
+    for root in orjson.loads(explained[1]):
+        _, root_input, root_blocked = _plan_rows(root)
+        largest_input = max(largest_input, root_input)
+        largest_blocked = max(largest_blocked, root_blocked)
+    return largest_input, largest_blocked
+
+
+@lru_cache(maxsize=1024)
 def escape_identifier(name: str) -> str:
     """Escape a SQL identifier by quoting it."""
+    if '"' not in name:
+        return f'"{name}"'
     return '"' + name.replace('"', '""') + '"'
 
 
 def escape_string(s: str) -> str:
-    """Escape a string literal for SQL."""
+    """
+    Escape a string literal for SQL.
+
+    Deliberately not cached: literals include passwords and tokens, which
+    shouldn't be kept alive in a process-wide cache. Most values contain no
+    quote at all, so those are wrapped without going through str.replace.
+    """
+    if "'" not in s:
+        return f"'{s}'"
     return "'" + s.replace("'", "''") + "'"
 
 
-def load_source(
-    con: duckdb.DuckDBPyConnection,
+def _parquet_opts(src: dict) -> str:
+    """
+    Build read_parquet options for multi-file sources.
+
+    hive_partitioning prunes partitions from filters on key=value paths, and
+    union_by_name aligns files whose columns differ. Both are opt-in, since
+    union_by_name has to read every file's schema before planning.
+    """
+    opts = [
+        f"{key}={str(bool(src[key])).lower()}"
+        for key in ("hive_partitioning", "union_by_name")
+        if src.get(key) is not None
+    ]
+    return ", " + ", ".join(opts) if opts else ""
+
+
+def source_sql(
     src: dict,
     secrets: Optional[Dict[str, AnySecret]] = None,
-) -> None:
+    catalog: str = "memory",
+) -> tuple[list[str], list[str]]:
     """
-    Register a data source as a DuckDB view.
+    Build the SQL that registers a data source as a DuckDB view, or as a
+    temp table when the source sets 'materialize'.
 
     This creates named views for data sources, allowing users to write
     cleaner SQL with aliases instead of full paths.
 
     If src contains a 'secret' field, it references a named secret from
-    the secrets dict to get connection credentials.
+    the secrets dict to get connection credentials. catalog is the
+    connection's default database, where views are created.
 
     Note: DuckDB supports direct file queries (SELECT * FROM 'file.csv')
     without creating views. The view approach is used here to:
     - Provide simple aliases for complex paths
     - Enable multi-file joins with readable names
     - Keep user queries path-agnostic
+
+    Returns:
+        (extensions, statements): extensions that must be loaded first, and
+        the statements to execute
     """
     stype = src.get("type")
     alias = src.get("alias")
@@ -765,124 +1460,182 @@ def load_source(
         # For sources that reference secrets, use secret credentials
         src = {**secret_dict, **src}
 
+    # Materialized sources are read once into a temp table instead of being
+    # re-scanned by every reference. A temp table shadows a view of the same
+    # name, so drop whichever kind this alias isn't. The view is named with
+    # its catalog: the temp catalog has a "main" schema too, so neither
+    # "users" nor "main.users" gets past the temp table.
+    if src.get("materialize"):
+        create = "CREATE OR REPLACE TEMP TABLE"
+        drop_other = (
+            f"DROP VIEW IF EXISTS {escape_identifier(catalog)}.main.{escaped_alias}"
+        )
+    else:
+        create = "CREATE OR REPLACE VIEW"
+        drop_other = f"DROP TABLE IF EXISTS temp.{escaped_alias}"
+
+    extensions: list[str] = []
+    statements: list[str] = [drop_other]
+
     if stype == "file":
         path = src["path"]
         escaped_path = escape_string(path)
-        # Handle glob patterns - extract extension from pattern
-        clean_path = path.rstrip("*").rstrip("/")
-        ext = os.path.splitext(clean_path)[1].lower()
-        
+        reader, ext = detect_reader(path)
+
         # Get optional CSV parameters
         delimiter = src.get("delimiter") or src.get("sep")
         header = src.get("header")
 
         # DuckDB can auto-detect file types for common extensions
         # Using explicit functions for clarity and to support all extensions
-        if ext in (".csv", ".tsv"):
+        if reader == "read_csv":
             csv_opts = []
             if delimiter:
                 csv_opts.append(f"sep={escape_string(delimiter)}")
-            elif ext == ".tsv":
+            elif ext.startswith(".tsv"):
                 csv_opts.append("sep='\\t'")
             if header is not None:
                 csv_opts.append(f"header={str(header).lower()}")
             opts_str = ", " + ", ".join(csv_opts) if csv_opts else ""
-            con.execute(
-                f"CREATE OR REPLACE VIEW {escaped_alias} AS "
+            statements.append(
+                f"{create} {escaped_alias} AS "
                 f"SELECT * FROM read_csv({escaped_path}{opts_str})"
             )
-        elif ext == ".parquet":
+        elif reader == "read_parquet":
             # Parquet supports projection/filter pushdown automatically
-            con.execute(
-                f"CREATE OR REPLACE VIEW {escaped_alias} AS "
-                f"SELECT * FROM read_parquet({escaped_path})"
+            statements.append(
+                f"{create} {escaped_alias} AS "
+                f"SELECT * FROM read_parquet({escaped_path}{_parquet_opts(src)})"
             )
-        elif ext in (".json", ".ndjson"):
+        elif reader == "read_json":
             # read_json auto-detects array vs newline-delimited format
-            con.execute(
-                f"CREATE OR REPLACE VIEW {escaped_alias} AS "
+            statements.append(
+                f"{create} {escaped_alias} AS "
                 f"SELECT * FROM read_json({escaped_path})"
             )
-        elif ext == ".xlsx":
+        elif reader == "read_xlsx":
             # Excel extension required; .xls files not supported
-            con.execute("INSTALL excel; LOAD excel;")
-            con.execute(
-                f"CREATE OR REPLACE VIEW {escaped_alias} AS "
+            extensions.append("excel")
+            statements.append(
+                f"{create} {escaped_alias} AS "
                 f"SELECT * FROM read_xlsx({escaped_path})"
             )
         else:
             raise ValueError(f"Unsupported file extension: {ext}")
 
     elif stype == "postgres":
-        con.execute("INSTALL postgres; LOAD postgres;")
+        extensions.append("postgres")
         schema = src.get("schema", "public")
         conn_str = (
             f"host={src['host']} port={src.get('port', 5432)} "
             f"dbname={src['database']} user={src['user']} password={src['password']}"
         )
         table = src["table"]
-        con.execute(
-            f"CREATE OR REPLACE VIEW {escaped_alias} AS "
+        statements.append(
+            f"{create} {escaped_alias} AS "
             f"SELECT * FROM postgres_scan({escape_string(conn_str)}, {escape_string(schema)}, {escape_string(table)})"
         )
 
     elif stype == "mysql":
-        con.execute("INSTALL mysql; LOAD mysql;")
+        extensions.append("mysql")
         conn_str = (
             f"host={src['host']} port={src.get('port', 3306)} "
             f"database={src['database']} user={src['user']} password={src['password']}"
         )
         table = src["table"]
-        # Use ATTACH for MySQL (mysql_scan is deprecated)
-        con.execute(f"ATTACH {escape_string(conn_str)} AS mysql_tmp (TYPE mysql, READ_ONLY)")
-        con.execute(
-            f"CREATE OR REPLACE VIEW {escaped_alias} AS "
-            f"SELECT * FROM mysql_tmp.{escape_identifier(table)}"
+        # Use ATTACH for MySQL (mysql_scan is deprecated). The database stays
+        # attached under a per-alias name because the view reads through it.
+        attached = escape_identifier(f"mysql_{alias}")
+        statements.append(
+            f"ATTACH OR REPLACE {escape_string(conn_str)} AS {attached} (TYPE mysql, READ_ONLY)"
+        )
+        statements.append(
+            f"{create} {escaped_alias} AS "
+            f"SELECT * FROM {attached}.{escape_identifier(table)}"
         )
-        con.execute("DETACH mysql_tmp")
 
     elif stype == "sqlite":
-        con.execute("INSTALL sqlite; LOAD sqlite;")
+        extensions.append("sqlite")
         path = src["path"]
         table = src["table"]
-        con.execute(
-            f"CREATE OR REPLACE VIEW {escaped_alias} AS "
+        statements.append(
+            f"{create} {escaped_alias} AS "
             f"SELECT * FROM sqlite_scan({escape_string(path)}, {escape_string(table)})"
         )
 
     elif stype == "s3":
-        con.execute("INSTALL httpfs; LOAD httpfs;")
+        extensions.append("httpfs")
         if "aws_access_key_id" in src:
-            con.execute(f"SET s3_access_key_id={escape_string(src['aws_access_key_id'])}")
-            con.execute(f"SET s3_secret_access_key={escape_string(src['aws_secret_access_key'])}")
+            statements.append(f"SET s3_access_key_id={escape_string(src['aws_access_key_id'])}")
+            statements.append(f"SET s3_secret_access_key={escape_string(src['aws_secret_access_key'])}")
         if "aws_region" in src:
-            con.execute(f"SET s3_region={escape_string(src['aws_region'])}")
+            statements.append(f"SET s3_region={escape_string(src['aws_region'])}")
         url = src["url"]
         # S3 URLs can point to parquet, csv, or json - infer from extension
-        ext = os.path.splitext(url.split('?')[0].rstrip('*/'))[1].lower()
-        if ext == ".csv":
-            reader = "read_csv"
-        elif ext == ".json" or ext == ".ndjson":
-            reader = "read_json"
-        else:
+        reader, _ = detect_reader(url)
+        opts_str = ""
+        if reader not in ("read_csv", "read_json"):
             reader = "read_parquet"  # default for S3
-        con.execute(
-            f"CREATE OR REPLACE VIEW {escaped_alias} AS "
-            f"SELECT * FROM {reader}({escape_string(url)})"
+            opts_str = _parquet_opts(src)
+        statements.append(
+            f"{create} {escaped_alias} AS "
+            f"SELECT * FROM {reader}({escape_string(url)}{opts_str})"
         )
 
     else:
         raise ValueError(f"Unknown source type: {stype!r}")
 
+    return extensions, statements
 
-def main() -> None:
-    raw = sys.stdin.read()
-    try:
-        req = json.loads(raw)
-    except Exception as e:
-        print(json.dumps({"error": f"Invalid JSON input: {e}"}))
-        return
 
+def setup_connection(
+    con: duckdb.DuckDBPyConnection,
+    sources: list[dict],
+    secrets_config: Optional[SecretsConfig] = None,
+    cache_httpfs: bool = False,
+) -> None:
+    """
+    Register secrets and aliased sources in a single batched execute.
+
+    Extensions the sources need are loaded beforehand in their own calls,
+    then every CREATE SECRET and CREATE VIEW statement is sent as one script
+    so DuckDB handles the whole setup in one round trip. cache_httpfs opts
+    remote sources into in-memory read caching.
+    """
+    secrets = secrets_config.secrets if secrets_config else None
+    pending_secrets = _pending_secret_sql(con, secrets_config) if secrets_config else {}
+
+    catalog = "memory"
+    if any(src.get("materialize") for src in sources):
+        # Materialized sources drop a same-named view by its full name
+        catalog = con.execute("SELECT current_database()").fetchone()[0]
+
+    statements = list(pending_secrets.values())
+    for src in sources:
+        extensions, src_statements = source_sql(src, secrets, catalog)
+        _ensure_exts(con, extensions, cache_httpfs)
+        statements.extend(src_statements)
+
+    if statements:
+        con.execute(";\n".join(statements))
+    if pending_secrets:
+        _REGISTERED_SECRETS.setdefault(con, {}).update(pending_secrets)
+
+
+def handle_request(
+    req: dict,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+    markdown_as_json: bool = False,
+) -> bytes:
+    """
+    Execute a single request and return the UTF-8 encoded response.
+
+    Args:
+        req: Parsed request object
+        con: Connection to reuse; a fresh one is opened when omitted
+        markdown_as_json: Wrap markdown tables as {"markdown": ...} so every
+            response is a single JSON line (used by daemon mode)
+    """
     # Determine mode: explore, query (default), or write (if output provided)
     mode = req.get("mode", "query")
 
@@ -894,20 +1647,18 @@ def main() -> None:
         secrets_file = req.get("secrets_file")
 
         if not path and not sources:
-            print(json.dumps({"error": "Explore mode requires 'path' or 'sources'"}))
-            return
+            return _dumps({"error": "Explore mode requires 'path' or 'sources'"})
 
         try:
-            con = duckdb.connect(database=":memory:")
-            con.execute("PRAGMA memory_limit='1GB';")
-            con.execute("PRAGMA threads=4;")
+            if con is None:
+                con = connect()
 
-            # Load secrets if needed
-            secrets_dict: Optional[Dict[str, AnySecret]] = None
-            if secrets_file:
-                secrets_config = load_secrets_from_yaml(secrets_file)
-                secrets_dict = secrets_config.secrets
-                register_all_secrets(con, secrets_config)
+            # Load secrets if needed, and register the first source when
+            # exploring by alias
+            secrets_config = (
+                load_secrets_from_yaml(secrets_file) if secrets_file else None
+            )
+            setup_connection(con, [] if path else sources[:1], secrets_config)
 
             # Determine target to explore
             if path:
@@ -916,52 +1667,45 @@ def main() -> None:
                 result = explore_data(con, target, sample_rows, file_path=path)
             else:
                 # Explore first source via alias
-                src = sources[0]
-                alias = src.get("alias", "source")
-                load_source(con, src, secrets_dict)
+                alias = sources[0].get("alias", "source")
                 target = escape_identifier(alias)
                 result = explore_data(con, target, sample_rows)
                 result["source"] = alias
 
-            print(json.dumps(result, default=str))
+            return _dumps(result)
 
         except FileNotFoundError as e:
-            print(json.dumps({"error": str(e)}))
+            return _dumps({"error": str(e)})
         except Exception as e:
-            print(json.dumps({"error": str(e)}))
-        return
+            return _dumps({"error": str(e)})
 
     # === QUERY/WRITE MODE ===
     query = req.get("query")
     if not query:
-        print(json.dumps({"error": "Missing 'query'"}))
-        return
+        return _dumps({"error": "Missing 'query'"})
+
+    params = req.get("params")  # Values bound to '?' placeholders in query
+    if params is not None and not isinstance(params, list):
+        return _dumps({"error": "'params' must be a list"})
 
     sources = req.get("sources", [])
     options = req.get("options", {})
     secrets_file = req.get("secrets_file")
     output_config_raw = req.get("output")  # Write mode configuration
-    max_rows = int(options.get("max_rows", DEFAULT_MAX_ROWS))
-    max_bytes = int(options.get("max_bytes", DEFAULT_MAX_BYTES))
     output_format = options.get("format", "markdown")  # markdown, json, records, csv
 
     # Load secrets from YAML file if provided
     secrets_config: Optional[SecretsConfig] = None
-    secrets_dict = None
-    
+
     if secrets_file:
         try:
             secrets_config = load_secrets_from_yaml(secrets_file)
-            secrets_dict = secrets_config.secrets
         except FileNotFoundError as e:
-            print(json.dumps({"error": str(e)}))
-            return
+            return _dumps({"error": str(e)})
         except yaml.YAMLError as e:
-            print(json.dumps({"error": f"Invalid YAML in secrets file: {e}"}))
-            return
+            return _dumps({"error": f"Invalid YAML in secrets file: {e}"})
         except ValueError as e:
-            print(json.dumps({"error": f"Secret validation error: {e}"}))
-            return
+            return _dumps({"error": f"Secret validation error: {e}"})
         except Exception as e:
             # Pydantic validation errors
             error_msg = str(e)
@@ -974,21 +1718,37 @@ def main() -> None:
                     msg = err.get("msg", "")
                     error_details.append(f"{loc}: {msg}")
                 error_msg = "Secret validation failed: " + "; ".join(error_details)
-            print(json.dumps({"error": error_msg}))
-            return
+            return _dumps({"error": error_msg})
 
+    # Limits set on a reused connection for this request only
+    restore_limits = False
     try:
-        con = duckdb.connect(database=":memory:")
-        con.execute("PRAGMA memory_limit='1GB';")
-        con.execute("PRAGMA threads=4;")
+        max_rows = int(options.get("max_rows", DEFAULT_MAX_ROWS))
+        max_bytes = int(options.get("max_bytes", DEFAULT_MAX_BYTES))
+        threads = int(options.get("threads", DEFAULT_THREADS))
+        memory_limit = str(options.get("memory_limit", DEFAULT_MEMORY_LIMIT))
+
+        warnings: list[str] = []
+        if (
+            "threads" in options
+            and threads < S3_MIN_THREADS
+            and any(src.get("type") == "s3" for src in sources)
+        ):
+            warnings.append(
+                f"threads={threads} may leave S3 reads waiting on the network; "
+                f"consider threads >= {S3_MIN_THREADS}."
+            )
 
-        # Register secrets with DuckDB if provided
-        if secrets_config:
-            register_all_secrets(con, secrets_config)
+        if con is None:
+            con = connect(threads, memory_limit)
+        elif "threads" in options or "memory_limit" in options:
+            con.execute(resource_limits_sql(threads, memory_limit))
+            restore_limits = True
 
-        # Register aliased sources as views
-        for src in sources:
-            load_source(con, src, secrets_dict)
+        # Register secrets and aliased sources as views
+        setup_connection(
+            con, sources, secrets_config, bool(options.get("cache_httpfs", False))
+        )
 
         # === WRITE MODE ===
         # If output config is provided, write results to file and return metadata
@@ -996,12 +1756,12 @@ def main() -> None:
             try:
                 output_cfg = OutputConfig(**output_config_raw)
             except Exception as e:
-                print(json.dumps({"error": f"Invalid output configuration: {e}"}))
-                return
+                return _dumps({"error": f"Invalid output configuration: {e}"})
             
             try:
-                result = write_output(con, query, output_cfg)
-                print(json.dumps(result, default=str))
+                result = write_output(con, query, output_cfg, params)
+                result["warnings"].extend(warnings)
+                return _dumps(result)
             except Exception as e:
                 error_msg = str(e)
                 # Check for overwrite error
@@ -1010,8 +1770,7 @@ def main() -> None:
                         f"Output path already exists: {output_cfg.path}. "
                         "Set options.overwrite=true to overwrite."
                     )
-                print(json.dumps({"success": False, "error": error_msg}))
-            return
+                return _dumps({"success": False, "error": error_msg})
 
         # === QUERY MODE ===
         # Detect utility statements (DESCRIBE, SUMMARIZE, etc.) that can't be wrapped
@@ -1019,89 +1778,185 @@ def main() -> None:
         
         if is_utility:
             # Execute utility statements directly with row limit
-            res = con.execute(query)
+            res = con.execute(query, params)
         else:
-            # Wrap regular queries for limit control
-            wrapped_query = f"SELECT * FROM ({query}) AS q LIMIT {max_rows + 1}"
-            res = con.execute(wrapped_query)
-        
-        # Convert to Polars DataFrame using .pl() for efficient formatting
-        df = res.pl()
+            if options.get("check_cardinality", False):
+                # Catch row explosions at plan time, before a sort, window or
+                # hash-join build exhausts the memory limit. Statements
+                # EXPLAIN can't handle are checked by DuckDB when they run.
+                try:
+                    largest_input, largest = estimate_cardinality(con, query, params)
+                except duckdb.Error:
+                    largest_input = largest = 0
+                if (
+                    largest > CARDINALITY_MAX_ROWS
+                    and largest > largest_input * CARDINALITY_EXPANSION_FACTOR
+                ):
+                    return _dumps({
+                        "error": (
+                            f"Query is estimated to hold ~{largest:,} intermediate "
+                            f"rows from inputs of at most ~{largest_input:,} rows "
+                            "(e.g. a cross or many-to-many join feeding a sort, "
+                            "window or join). Add join conditions, filters or a "
+                            "LIMIT, or drop options.check_cardinality to run it "
+                            "anyway."
+                        )
+                    })
+
+            # Apply the row limit on the relation rather than re-parsing the
+            # query inside a wrapping subquery, and skip it when the query
+            # already limits itself. Statements that aren't queries (DDL,
+            # COPY, INSERT, ...) run immediately and return no relation.
+            rel = con.sql(query, params=params)
+            if rel is None or has_row_limit(query, max_rows):
+                res = rel
+            else:
+                res = rel.limit(max_rows + 1)
         
+        # Stream at most max_rows + 1 rows as Arrow batches; Polars is only
+        # built (zero-copy) for the formats that need it
+        arrow_tbl = (
+            _dedupe_columns(fetch_arrow(res, max_rows + 1))
+            if res is not None
+            else pa.table({})
+        )
+
         truncated = False
-        if len(df) > max_rows:
-            df = df.head(max_rows)
+        if arrow_tbl.num_rows > max_rows:
+            arrow_tbl = arrow_tbl.slice(0, max_rows)
             truncated = True
 
         # Format output based on requested format
         if output_format == "markdown":
-            # Use Polars Config for clean markdown table output
-            with pl.Config(
-                tbl_formatting="MARKDOWN",
-                tbl_hide_dataframe_shape=True,
-                tbl_hide_column_data_types=True,
-                set_tbl_width_chars=1000,
-                tbl_rows=max_rows,
-            ):
-                table = str(df)
-            
-            result_parts = [table]
+            # Statements without a result set (DDL, INSERT, ...) have no table
+            result_parts = [
+                arrow_to_markdown(arrow_tbl) if res is not None else "*Statement executed*"
+            ]
             if truncated:
-                result_parts.append(f"\n*Results truncated to {len(df)} rows*")
+                result_parts.append(
+                    f"\n*Results truncated to {arrow_tbl.num_rows} rows*"
+                )
+            for warning in warnings:
+                result_parts.append(f"\n*Warning: {warning}*")
             
-            print("\n".join(result_parts))
-            return
-        elif output_format == "records":
-            # Return as list of dicts (JSON records)
-            out_obj = {
-                "data": df.to_dicts(),
-                "truncated": truncated,
-                "warnings": [],
-                "error": None,
-            }
-        elif output_format == "csv":
-            # Return as CSV string
-            out_obj = {
-                "csv": df.write_csv(),
-                "truncated": truncated,
-                "warnings": [],
-                "error": None,
-            }
-        else:
-            # json format with schema + rows
-            schema = [{"name": col, "type": str(dtype)} for col, dtype in zip(df.columns, df.dtypes)]
-            rows = df.rows()
-            out_obj = {
-                "schema": schema,
-                "rows": rows,
-                "truncated": truncated,
-                "warnings": [],
-                "error": None,
-            }
-
-        encoded = json.dumps(out_obj, default=str)
-        if len(encoded.encode("utf-8")) > max_bytes:
-            # Progressively trim rows to fit size limit
-            while len(df) > 0 and len(encoded.encode("utf-8")) > max_bytes:
-                df = df.head(max(1, len(df) * 3 // 4))
-                truncated = True
-                if output_format == "records":
-                    out_obj["data"] = df.to_dicts()
-                elif output_format == "csv":
-                    out_obj["csv"] = df.write_csv()
-                else:
-                    out_obj["rows"] = df.rows()
-                out_obj["truncated"] = truncated
-                encoded = json.dumps(out_obj, default=str)
+            markdown = "\n".join(result_parts)
+            if markdown_as_json:
+                return _dumps({"markdown": markdown})
+            return markdown.encode("utf-8")
+
+        # Unknown formats fall back to json (schema + rows)
+        formatter = OUTPUT_FORMATTERS.get(output_format, json_output)
+        out_obj = {
+            **formatter(arrow_tbl),
+            "truncated": truncated,
+            "warnings": warnings,
+            "error": None,
+        }
+
+        encoded = _dumps(out_obj)
+        if len(encoded) > max_bytes:
+            out_obj["truncated"] = truncated = True
             out_obj["warnings"].append(
                 "Output truncated to respect max_bytes; try more aggregation or filters."
             )
-            encoded = json.dumps(out_obj, default=str)
+            if output_format == "csv":
+                # Serialized size is roughly linear in row count, so estimate
+                # the rows that fit from the average bytes per row; keep
+                # shrinking by a quarter only if the estimate still overshoots
+                bytes_per_row = len(encoded) / max(1, arrow_tbl.num_rows)
+                target_rows = int(max_bytes / bytes_per_row * 0.95)
+                while arrow_tbl.num_rows > 0 and len(encoded) > max_bytes:
+                    target_rows = max(0, min(target_rows, arrow_tbl.num_rows - 1))
+                    arrow_tbl = arrow_tbl.slice(0, target_rows)
+                    out_obj.update(csv_output(arrow_tbl))
+                    encoded = _dumps(out_obj)
+                    target_rows = arrow_tbl.num_rows * 3 // 4
+            else:
+                # Encode each row once and keep the longest prefix that fits
+                key = "data" if output_format == "records" else "rows"
+                fragments = _row_fragments(arrow_tbl, output_format)
+                encoded = _fit_row_fragments(out_obj, key, fragments, max_bytes)
 
-        print(encoded)
+        return encoded
 
     except Exception as e:
-        print(json.dumps({"error": str(e)}))
+        return _dumps({"error": str(e)})
+
+    finally:
+        if restore_limits:
+            # Later requests on this connection get the defaults back
+            con.execute(resource_limits_sql(DEFAULT_THREADS, DEFAULT_MEMORY_LIMIT))
+
+
+def run_request(
+    req: dict, con: Optional[duckdb.DuckDBPyConnection] = None
+) -> dict:
+    """
+    Execute a request in-process and return the decoded response.
+
+    Same behaviour as the CLI without the pipe round trip; markdown results
+    come back as {"markdown": ...} like in daemon mode.
+    """
+    return orjson.loads(handle_request(req, con, markdown_as_json=True))
+
+
+def _emit(out: bytes) -> None:
+    """Write one encoded response line to stdout."""
+    sys.stdout.buffer.write(out + b"\n")
+    sys.stdout.flush()
+
+
+def _emit_error(message: str) -> None:
+    """Write an error response line to stdout."""
+    _emit(_dumps({"error": message}))
+
+
+def serve() -> None:
+    """
+    Daemon mode: answer newline-delimited JSON requests from stdin.
+
+    The process-wide connection is held for the whole session, so
+    extensions, secrets and file caches are reused across requests. Each
+    response is written as a single JSON line; the loop ends at EOF.
+    A request that fails unexpectedly gets an error response and the loop
+    carries on with the next line.
+    """
+    con = _get_connection()
+    for line in sys.stdin.buffer:
+        if not line.strip():
+            continue
+        try:
+            req = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            _emit_error(f"Invalid JSON input: {e}")
+            continue
+        if not isinstance(req, dict):
+            _emit_error("Request must be a JSON object")
+            continue
+        try:
+            out = handle_request(req, con, markdown_as_json=True)
+        except Exception as e:
+            _emit_error(str(e))
+        else:
+            _emit(out)
+
+
+def main() -> None:
+    if "--daemon" in sys.argv[1:]:
+        serve()
+        return
+
+    # Let orjson decode the raw bytes rather than decoding stdin as text first
+    raw = sys.stdin.buffer.read()
+    try:
+        req = orjson.loads(raw)
+    except orjson.JSONDecodeError as e:
+        _emit_error(f"Invalid JSON input: {e}")
+    else:
+        if isinstance(req, dict):
+            _emit(handle_request(req))
+        else:
+            _emit_error("Request must be a JSON object")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,19 @@
+"""Shared pytest fixtures."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Make the skill script importable for in-process tests
+sys.path.insert(0, str(Path(__file__).parent.parent / "skills" / "data-wrangler" / "scripts"))
+
+from query_duckdb import connect
+
+
+@pytest.fixture(scope="session")
+def duckdb_conn():
+    """One configured DuckDB connection shared by in-process tests."""
+    con = connect()
+    yield con
+    con.close()
@@ -1,9 +1,9 @@
 """Tests for explore mode functionality."""
 
-import json
 import subprocess
 from pathlib import Path
 
+import orjson
 import pytest
 
 SCRIPT_PATH = Path(__file__).parent.parent / "skills" / "data-wrangler" / "scripts" / "query_duckdb.py"
@@ -13,7 +13,7 @@ def run_script(request: dict) -> dict:
     """Run the query script with the given request and return parsed output."""
     result = subprocess.run(
         ["uv", "run", str(SCRIPT_PATH)],
-        input=json.dumps(request),
+        input=orjson.dumps(request).decode(),
         capture_output=True,
         text=True,
         cwd=SCRIPT_PATH.parent,
@@ -25,8 +25,8 @@ def run_script(request: dict) -> dict:
         return {"error": f"No output. stderr: {result.stderr}"}
     
     try:
-        return json.loads(output)
-    except json.JSONDecodeError:
+        return orjson.loads(output)
+    except orjson.JSONDecodeError:
         # Might be markdown output, return as-is
         return {"raw_output": output}
 
@@ -169,6 +169,18 @@ class TestExploreOptions:
         # Markdown table: header + separator + 5 data rows = 7 lines
         assert len(sample_lines) <= 8  # Allow some flexibility
 
+    def test_zero_sample_rows(self, tmp_path):
+        """Test sample_rows=0 returns the schema with an empty sample table."""
+        csv_file = tmp_path / "data.csv"
+        csv_file.write_text("id,name\n1,alice\n")
+
+        req = {"mode": "explore", "path": str(csv_file), "sample_rows": 0}
+        result = run_script(req)
+
+        assert "error" not in result
+        assert result["sample"].strip().split("\n")[0] == "| id | name |"
+        assert len(result["sample"].strip().split("\n")) == 2
+
 
 class TestExploreErrors:
     """Test explore mode error handling."""
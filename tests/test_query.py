@@ -1,9 +1,15 @@
 """Tests for query mode functionality."""
 
+import gzip
 import json
+import re
 import subprocess
 from pathlib import Path
 
+import orjson
+
+from query_duckdb import run_request
+
 
 SCRIPT_PATH = Path(__file__).parent.parent / "skills" / "data-wrangler" / "scripts" / "query_duckdb.py"
 
@@ -12,7 +18,7 @@ def run_script(request_obj: dict) -> str | dict:
     """Run the query_duckdb.py script and return output."""
     result = subprocess.run(
         ["uv", "run", str(SCRIPT_PATH)],
-        input=json.dumps(request_obj),
+        input=orjson.dumps(request_obj).decode(),
         capture_output=True,
         text=True,
         cwd=str(SCRIPT_PATH.parent.parent.parent.parent),
@@ -24,8 +30,8 @@ def run_script_json(request_obj: dict) -> dict:
     """Run script and parse JSON response."""
     stdout, stderr = run_script(request_obj)
     try:
-        return json.loads(stdout)
-    except json.JSONDecodeError:
+        return orjson.loads(stdout)
+    except orjson.JSONDecodeError:
         return {"raw_stdout": stdout, "raw_stderr": stderr}
 
 
@@ -52,6 +58,32 @@ class TestQueryModeMarkdown:
         # Should have header separator
         assert "---" in stdout or "─" in stdout
 
+    def test_markdown_pads_columns_and_renders_nulls(self):
+        """Test markdown cells are padded to the widest value and nulls shown."""
+        req = {"query": "SELECT * FROM (VALUES ('a'), (NULL), ('wide')) t(s)"}
+        stdout, _ = run_script(req)
+
+        assert stdout.splitlines()[:5] == [
+            "| s    |",
+            "|------|",
+            "| a    |",
+            "| null |",
+            "| wide |",
+        ]
+
+    def test_markdown_matches_polars_for_other_types(self):
+        """Test floats, timestamps and structs render as Polars shows them."""
+        req = {
+            "query": "SELECT 'NaN'::DOUBLE AS nan, 1e10::DOUBLE AS big, "
+            "TIMESTAMP '2024-01-01 10:00:00.5' AS ts, {'a': 1, 'b': 'x'} AS st"
+        }
+        stdout, _ = run_script(req)
+
+        row = stdout.strip().split("\n")[2]
+        assert [cell.strip() for cell in row.strip("|").split("|")] == [
+            "NaN", "1.0000e10", "2024-01-01 10:00:00.500", '{1,"x"}'
+        ]
+
     def test_markdown_truncation_message(self):
         """Test truncation message appears when results exceed limit."""
         req = {
@@ -111,6 +143,25 @@ class TestQueryModeRecords:
         assert result["data"][0]["name"] == "alice"
         assert result["data"][1]["id"] == 2
 
+    def test_timestamps_use_iso_8601_in_every_json_format(self):
+        """Test naive and tz-aware timestamps are encoded alike across JSON paths."""
+        query = (
+            "SELECT TIMESTAMP '2024-01-01 10:00:00' AS ts, "
+            "TIMESTAMPTZ '2024-01-01 10:00:00+00' AS tz"
+        )
+        records = run_script_json({"query": query, "options": {"format": "records"}})
+        with_blob = run_script_json(
+            {"query": query + ", '\\x01'::BLOB AS b", "options": {"format": "records"}}
+        )
+        as_json = run_script_json({"query": query, "options": {"format": "json"}})
+
+        ts, tz = records["data"][0]["ts"], records["data"][0]["tz"]
+        assert ts == "2024-01-01T10:00:00"
+        # The offset depends on the session time zone
+        assert re.fullmatch(r"2024-01-01T\d\d:00:00[+-]\d\d:\d\d", tz)
+        assert [with_blob["data"][0]["ts"], with_blob["data"][0]["tz"]] == [ts, tz]
+        assert as_json["rows"][0] == [ts, tz]
+
 
 class TestQueryModeCSV:
     """Test CSV output format."""
@@ -185,6 +236,68 @@ class TestQueryFromFile:
         assert result["data"][0]["id"] == 1
 
 
+class TestQueryParams:
+    """Test binding request params to query placeholders."""
+
+    def test_params_bound_to_placeholders(self):
+        """Test that params fill '?' placeholders in order."""
+        req = {
+            "query": "SELECT n FROM range(10) t(n) WHERE n >= ? AND n < ?",
+            "params": [3, 5],
+            "options": {"format": "records"}
+        }
+        result = run_script_json(req)
+
+        assert result["error"] is None
+        assert result["data"] == [{"n": 3}, {"n": 4}]
+
+    def test_params_must_be_list(self):
+        """Test error when params is not a list."""
+        result = run_script_json({"query": "SELECT ?", "params": 1})
+
+        assert "params" in result["error"]
+
+
+class TestResourceOptions:
+    """Test DuckDB resource limits set through options."""
+
+    def test_threads_and_memory_limit_applied(self):
+        """Test threads and memory_limit options configure the connection."""
+        req = {
+            "query": "SELECT current_setting('threads') AS threads, "
+            "current_setting('memory_limit') AS memory_limit",
+            "options": {"format": "records", "threads": 2, "memory_limit": "512MB"},
+        }
+        result = run_script_json(req)
+
+        assert result["error"] is None
+        assert result["data"][0]["threads"] == 2
+        assert result["data"][0]["memory_limit"].endswith("MiB")
+
+    def test_limits_reset_between_daemon_requests(self):
+        """Test one daemon request's limits don't carry over to the next."""
+        setting = {
+            "query": "SELECT current_setting('threads') AS threads",
+            "options": {"format": "records"},
+        }
+        requests = [
+            setting,
+            {**setting, "options": {"format": "records", "threads": 3}},
+            setting,
+        ]
+        result = subprocess.run(
+            ["uv", "run", str(SCRIPT_PATH), "--daemon"],
+            input="\n".join(json.dumps(r) for r in requests) + "\n",
+            capture_output=True,
+            text=True,
+            cwd=str(SCRIPT_PATH.parent.parent.parent.parent),
+        )
+        responses = [json.loads(line) for line in result.stdout.splitlines()]
+
+        assert responses[1]["data"] == [{"threads": 3}]
+        assert responses[2]["data"] == responses[0]["data"]
+
+
 class TestQueryWithSources:
     """Test aliased sources."""
 
@@ -233,6 +346,116 @@ class TestQueryWithSources:
         # Handle both int and string representations
         assert int(result["data"][0]["total"]) == 150
 
+    def test_join_keeps_duplicate_column_names(self, tmp_path):
+        """Test SELECT * over a join renames the repeated key column in every format."""
+        users_file = tmp_path / "users.csv"
+        users_file.write_text("id,name\n1,alice\n")
+
+        orders_file = tmp_path / "orders.csv"
+        orders_file.write_text("id,total\n1,99\n")
+
+        req = {
+            "query": "SELECT * FROM users u JOIN orders o ON u.id = o.id",
+            "sources": [
+                {"type": "file", "alias": "users", "path": str(users_file)},
+                {"type": "file", "alias": "orders", "path": str(orders_file)}
+            ],
+        }
+
+        records = run_script_json({**req, "options": {"format": "records"}})
+        assert records["data"] == [{"id": 1, "name": "alice", "id_1": 1, "total": 99}]
+
+        as_json = run_script_json({**req, "options": {"format": "json"}})
+        assert [col["name"] for col in as_json["schema"]] == ["id", "name", "id_1", "total"]
+
+        as_csv = run_script_json({**req, "options": {"format": "csv"}})
+        assert as_csv["csv"].splitlines()[0] == "id,name,id_1,total"
+
+        stdout, _ = run_script(req)
+        assert "| id | name  | id_1 | total |" in stdout
+
+    def test_compressed_csv_source(self, tmp_path):
+        """Test .csv.gz sources are read as CSV rather than by their last suffix."""
+        csv_file = tmp_path / "users.csv.gz"
+        csv_file.write_bytes(gzip.compress(b"id,name\n1,alice\n2,bob\n"))
+
+        req = {
+            "query": "SELECT name FROM users ORDER BY id",
+            "sources": [{"type": "file", "alias": "users", "path": str(csv_file)}],
+            "options": {"format": "records"}
+        }
+        result = run_script_json(req)
+
+        assert result["error"] is None
+        assert result["data"] == [{"name": "alice"}, {"name": "bob"}]
+
+    def test_materialized_source(self, tmp_path):
+        """Test materialize loads the source into a temp table instead of a view."""
+        csv_file = tmp_path / "users.csv"
+        csv_file.write_text("id,name\n1,alice\n2,bob\n")
+
+        req = {
+            "query": """
+                SELECT table_type, (SELECT COUNT(*) FROM users a JOIN users b USING (id)) AS n
+                FROM information_schema.tables WHERE table_name = 'users'
+            """,
+            "sources": [
+                {"type": "file", "alias": "users", "path": str(csv_file), "materialize": True}
+            ],
+            "options": {"format": "records"}
+        }
+        result = run_script_json(req)
+
+        assert result["error"] is None
+        assert result["data"] == [{"table_type": "LOCAL TEMPORARY", "n": 2}]
+
+    def test_materialized_source_reregistered_on_shared_connection(self, tmp_path, duckdb_conn):
+        """Test the same materialized source can be registered again on one connection."""
+        csv_file = tmp_path / "users.csv"
+        csv_file.write_text("id,name\n1,alice\n2,bob\n")
+
+        req = {
+            "query": "SELECT COUNT(*) AS n FROM users",
+            "sources": [
+                {"type": "file", "alias": "users", "path": str(csv_file), "materialize": True}
+            ],
+            "options": {"format": "records"}
+        }
+        first = run_request(req, duckdb_conn)
+        second = run_request(req, duckdb_conn)
+
+        assert first["data"] == [{"n": 2}]
+        assert second["error"] is None
+        assert second["data"] == [{"n": 2}]
+
+    def test_partitioned_parquet_source(self, tmp_path):
+        """Test hive partition keys become columns and filter the source."""
+        output_dir = tmp_path / "sales"
+        run_script_json({
+            "query": "SELECT 2020 as year, 1 as value UNION ALL SELECT 2021, 2",
+            "output": {
+                "path": str(output_dir),
+                "format": "parquet",
+                "options": {"partition_by": ["year"]},
+            },
+        })
+
+        req = {
+            "query": "SELECT value, year FROM sales WHERE year = 2021",
+            "sources": [{
+                "type": "file",
+                "alias": "sales",
+                "path": str(output_dir / "*" / "*.parquet"),
+                "hive_partitioning": True,
+                "union_by_name": True,
+            }],
+            "options": {"format": "records"}
+        }
+        result = run_script_json(req)
+
+        assert result["error"] is None
+        assert result["data"] == [{"value": 2, "year": 2021}]
+
 
 class TestErrorHandling:
     """Test error messages are helpful."""
@@ -285,6 +508,12 @@ class TestErrorHandling:
         
         assert result.get("error") is not None
 
+    def test_malformed_source_returns_error(self):
+        """Test a non-object source gives a JSON error rather than a traceback."""
+        result = run_script_json({"query": "SELECT 1", "sources": [1]})
+
+        assert result["error"]
+
     def test_invalid_json_input(self):
         """Test error for malformed JSON input."""
         result = subprocess.run(
@@ -298,6 +527,31 @@ class TestErrorHandling:
         assert response.get("error") is not None
         assert "json" in response["error"].lower()
 
+    def test_exploding_join_rejected(self):
+        """Test that a cross join far larger than its inputs is rejected before running."""
+        req = {
+            "query": "SELECT * FROM range(100000) a, range(100000) b ORDER BY 1",
+            "options": {"format": "records", "check_cardinality": True}
+        }
+        result = run_script_json(req)
+
+        assert "intermediate rows" in result["error"]
+        assert "check_cardinality" in result["error"]
+
+    def test_streamed_cross_joins_not_rejected(self):
+        """Test cross joins feeding an aggregate or a LIMIT pass the cardinality check."""
+        for query in (
+            "SELECT count(*) AS n FROM range(5000) a, range(5000) b",
+            "SELECT * FROM range(20000) a, range(20000) b LIMIT 5",
+        ):
+            req = {
+                "query": query,
+                "options": {"format": "records", "check_cardinality": True}
+            }
+            result = run_script_json(req)
+
+            assert result["error"] is None, query
+
 
 class TestUtilityStatements:
     """Test DESCRIBE, SUMMARIZE, etc."""
@@ -415,6 +669,12 @@ class TestEdgeCases:
         assert result["error"] is None
         assert result["data"] == []
 
+    def test_statement_without_result_set(self):
+        """Test DDL in markdown mode reports execution instead of an empty table."""
+        stdout, _ = run_script({"query": "CREATE TABLE t AS SELECT 1 AS id"})
+
+        assert stdout.strip() == "*Statement executed*"
+
     def test_null_values(self):
         """Test handling of NULL values."""
         req = {
@@ -467,3 +727,96 @@ class TestEdgeCases:
         assert result["error"] is None
         assert len(result["data"]) == 50
         assert result["truncated"] is True
+
+    def test_query_limit_respected(self):
+        """Test that a query's own LIMIT is kept, and max_rows still applies above it."""
+        req = {
+            "query": "SELECT * FROM range(1000) t(n) LIMIT 5;",
+            "options": {"format": "records", "max_rows": 50}
+        }
+        result = run_script_json(req)
+        assert len(result["data"]) == 5
+        assert result["truncated"] is False
+
+        req["query"] = "SELECT * FROM range(1000) t(n) LIMIT 500"
+        result = run_script_json(req)
+        assert len(result["data"]) == 50
+        assert result["truncated"] is True
+
+    def test_max_bytes_truncation(self):
+        """Test that output is trimmed to fit max_bytes."""
+        req = {
+            "query": "SELECT n, repeat('x', 20) AS s FROM range(10000) t(n)",
+            "options": {"format": "records", "max_rows": 10000, "max_bytes": 2000}
+        }
+        stdout, _ = run_script(req)
+        result = json.loads(stdout)
+
+        assert len(stdout.encode("utf-8")) <= 2000
+        assert 0 < len(result["data"]) < 10000
+        assert result["truncated"] is True
+        assert result["warnings"]
+
+    def test_max_bytes_smaller_than_one_row(self):
+        """Test that a single oversized row doesn't hang the trimming loop."""
+        req = {
+            "query": "SELECT repeat('x', 5000) AS s",
+            "options": {"format": "records", "max_bytes": 1000}
+        }
+        result = run_script_json(req)
+
+        assert result["data"] == []
+        assert result["truncated"] is True
+
+
+class TestDaemonMode:
+    """Test newline-delimited request handling over one connection."""
+
+    def test_daemon_reuses_connection(self, tmp_path):
+        """Test that views from one request stay visible to the next."""
+        csv_file = tmp_path / "data.csv"
+        csv_file.write_text("id,name\n1,alice\n2,bob\n")
+
+        requests = [
+            {
+                "query": "SELECT COUNT(*) AS n FROM people",
+                "sources": [{"type": "file", "alias": "people", "path": str(csv_file)}],
+                "options": {"format": "records"},
+            },
+            {"query": "SELECT name FROM people ORDER BY id", "options": {"format": "records"}},
+            {"query": "SELECT 1 AS id"},
+        ]
+        result = subprocess.run(
+            ["uv", "run", str(SCRIPT_PATH), "--daemon"],
+            input="\n".join(json.dumps(r) for r in requests) + "\n",
+            capture_output=True,
+            text=True,
+            cwd=str(SCRIPT_PATH.parent.parent.parent.parent),
+        )
+        responses = [json.loads(line) for line in result.stdout.splitlines()]
+
+        assert len(responses) == 3
+        assert responses[0]["data"] == [{"n": 2}]
+        assert responses[1]["data"] == [{"name": "alice"}, {"name": "bob"}]
+        assert "| id |" in responses[2]["markdown"]
+
+    def test_daemon_survives_malformed_request(self):
+        """Test that a request that fails doesn't stop the daemon answering."""
+        requests = [
+            [1],
+            {"query": "SELECT 1", "sources": [1]},
+            {"query": "SELECT 1 AS id", "options": {"format": "records"}},
+        ]
+        result = subprocess.run(
+            ["uv", "run", str(SCRIPT_PATH), "--daemon"],
+            input="\n".join(json.dumps(r) for r in requests) + "\n",
+            capture_output=True,
+            text=True,
+            cwd=str(SCRIPT_PATH.parent.parent.parent.parent),
+        )
+        responses = [json.loads(line) for line in result.stdout.splitlines()]
+
+        assert len(responses) == 3
+        assert responses[0]["error"] == "Request must be a JSON object"
+        assert responses[1]["error"]
+        assert responses[2]["data"] == [{"id": 1}]
@@ -26,9 +26,11 @@ from query_duckdb import (
     AzureSecret,
     HTTPSecret,
     HuggingFaceSecret,
+    SecretsConfig,
     # Functions - these are what we're actually testing
     expand_env_vars,
     load_secrets_from_yaml,
+    _clear_cache,
     create_secret_sql,
     escape_string,
     escape_identifier,
@@ -81,6 +83,14 @@ class TestExpandEnvVars:
         with pytest.raises(ValueError, match="Environment variable not set"):
             expand_env_vars("${NONEXISTENT_VAR_XYZ}")
 
+    def test_all_missing_vars_reported(self):
+        """Test that every missing env var is named in one error."""
+        for name in ("MISSING_VAR_A", "MISSING_VAR_B"):
+            os.environ.pop(name, None)
+
+        with pytest.raises(ValueError, match="MISSING_VAR_A, MISSING_VAR_B"):
+            expand_env_vars({"a": "${MISSING_VAR_A}", "b": ["${MISSING_VAR_B}", "${MISSING_VAR_A}"]})
+
     def test_no_expansion_needed(self):
         """Test that strings without ${} are unchanged."""
         result = expand_env_vars("plain string")
@@ -99,7 +109,25 @@ class TestExpandEnvVars:
 
 
 class TestLoadSecretsFromYaml:
-    def test_valid_yaml_loads_and_validates(self):
+    @pytest.fixture
+    def write_yaml(self):
+        """Write YAML content to a temp file and remove it after the test."""
+        paths = []
+
+        def write(content: str) -> str:
+            fd, path = tempfile.mkstemp(suffix=".yaml")
+            os.write(fd, content.encode())
+            os.close(fd)
+            paths.append(path)
+            return path
+
+        try:
+            yield write
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+    def test_valid_yaml_loads_and_validates(self, write_yaml):
         """Test the full pipeline: YAML -> env expansion -> Pydantic."""
         yaml_content = """
 secrets:
@@ -110,23 +138,17 @@ secrets:
     password: secret
     database: mydb
 """
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".yaml", delete=False
-        ) as f:
-            f.write(yaml_content)
-            f.flush()
-            config = load_secrets_from_yaml(f.name)
+        config = load_secrets_from_yaml(write_yaml(yaml_content))
 
         assert "my_postgres" in config.secrets
         assert config.secrets["my_postgres"].host == "localhost"
-        os.unlink(f.name)
 
     def test_file_not_found(self):
         """Test that missing file raises FileNotFoundError."""
         with pytest.raises(FileNotFoundError):
             load_secrets_from_yaml("/nonexistent/path/secrets.yaml")
 
-    def test_env_var_expansion_integrated(self):
+    def test_env_var_expansion_integrated(self, write_yaml):
         """Test environment variable expansion during YAML loading."""
         os.environ["TEST_DB_PASSWORD"] = "secret123"
         yaml_content = """
@@ -138,26 +160,62 @@ secrets:
     password: "${TEST_DB_PASSWORD}"
     database: db
 """
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".yaml", delete=False
-        ) as f:
-            f.write(yaml_content)
-            f.flush()
-            config = load_secrets_from_yaml(f.name)
+        config = load_secrets_from_yaml(write_yaml(yaml_content))
 
         assert config.secrets["test_db"].password == "secret123"
-        os.unlink(f.name)
 
-    def test_empty_yaml_raises(self):
+    def test_trusted_load_skips_validation(self, write_yaml):
+        """Test trusted loading builds the correct model without validation."""
+        yaml_content = """
+secrets:
+  my_postgres:
+    type: postgres
+    host: localhost
+    user: analyst
+    password: secret
+    database: mydb
+    schema: analytics
+"""
+        config = load_secrets_from_yaml(write_yaml(yaml_content), trusted=True)
+
+        secret = config.secrets["my_postgres"]
+        assert isinstance(secret, PostgresSecret)
+        assert secret.port == 5432
+        assert secret.schema_ == "analytics"
+
+    def test_reload_after_file_change(self, write_yaml):
+        """Test a cached secrets file is re-read once it changes on disk."""
+        path = write_yaml("secrets:\n  hf:\n    type: huggingface\n    token: first\n")
+        try:
+            assert load_secrets_from_yaml(path).secrets["hf"].token == "first"
+            assert load_secrets_from_yaml(path).secrets["hf"].token == "first"
+
+            Path(path).write_text(
+                "secrets:\n  hf:\n    type: huggingface\n    token: second_token\n"
+            )
+            assert load_secrets_from_yaml(path).secrets["hf"].token == "second_token"
+        finally:
+            _clear_cache()
+
+    def test_cached_config_tracks_env_vars(self, write_yaml):
+        """Test an unchanged file reuses its config until a referenced env var changes."""
+        os.environ["TEST_HF_TOKEN"] = "first"
+        path = write_yaml('secrets:\n  hf:\n    type: huggingface\n    token: "${TEST_HF_TOKEN}"\n')
+        try:
+            config = load_secrets_from_yaml(path)
+            assert load_secrets_from_yaml(path) is config
+
+            os.environ["TEST_HF_TOKEN"] = "second"
+            reloaded = load_secrets_from_yaml(path)
+            assert reloaded is not config
+            assert reloaded.secrets["hf"].token == "second"
+        finally:
+            _clear_cache()
+
+    def test_empty_yaml_raises(self, write_yaml):
         """Test that empty YAML file raises ValueError."""
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".yaml", delete=False
-        ) as f:
-            f.write("")
-            f.flush()
-            with pytest.raises(ValueError, match="empty"):
-                load_secrets_from_yaml(f.name)
-        os.unlink(f.name)
+        with pytest.raises(ValueError, match="empty"):
+            load_secrets_from_yaml(write_yaml(""))
 
 
 # =============================================================================
@@ -244,6 +302,21 @@ class TestCreateSecretSql:
         assert "TYPE huggingface" in sql
         assert "TOKEN" in sql
 
+    def test_secrets_config_renders_all_secrets(self):
+        """Test SecretsConfig caches one CREATE SECRET statement per secret."""
+        config = SecretsConfig(
+            secrets={
+                "hf": {"type": "huggingface", "token": "hf_token"},
+                "web": {"type": "http", "bearer_token": "token123"},
+            }
+        )
+
+        assert config.secret_sql == {
+            name: create_secret_sql(name, secret)
+            for name, secret in config.secrets.items()
+        }
+        assert config.secret_sql is config.secret_sql
+
 
 # =============================================================================
 # SQL Escaping Tests (security-critical)
@@ -1,34 +1,26 @@
 """Tests for write/export functionality."""
 
 import json
-import subprocess
-from pathlib import Path
 
+import pytest
 
-SCRIPT_PATH = Path(__file__).parent.parent / "skills" / "data-wrangler" / "scripts" / "query_duckdb.py"
+from query_duckdb import run_request
 
 
-def run_script(request_obj: dict) -> dict:
-    """Run the query_duckdb.py script with the given request and return JSON response."""
-    result = subprocess.run(
-        ["uv", "run", str(SCRIPT_PATH)],
-        input=json.dumps(request_obj),
-        capture_output=True,
-        text=True,
-        cwd=str(SCRIPT_PATH.parent.parent.parent.parent),
-    )
-    # For write mode, output should be JSON
-    try:
-        return json.loads(result.stdout)
-    except json.JSONDecodeError:
-        # If not JSON, return raw output for debugging
-        return {"raw_stdout": result.stdout, "raw_stderr": result.stderr}
+@pytest.fixture
+def run_script(duckdb_conn):
+    """Run write requests in-process on the shared session connection."""
+
+    def run(request_obj: dict) -> dict:
+        return run_request(request_obj, duckdb_conn)
+
+    return run
 
 
 class TestWriteParquet:
     """Test Parquet file writing."""
 
-    def test_write_parquet_basic(self, tmp_path):
+    def test_write_parquet_basic(self, tmp_path, run_script):
         """Test basic Parquet write from inline data."""
         output_file = tmp_path / "output.parquet"
         req = {
@@ -49,7 +41,7 @@ class TestWriteParquet:
         assert str(output_file) in result.get("files_created", [])
         assert result.get("duration_ms") >= 0
 
-    def test_write_parquet_with_compression(self, tmp_path):
+    def test_write_parquet_with_compression(self, tmp_path, run_script):
         """Test Parquet write with zstd compression."""
         output_file = tmp_path / "compressed.parquet"
         req = {
@@ -65,7 +57,7 @@ class TestWriteParquet:
         assert result.get("success") is True
         assert output_file.exists()
 
-    def test_write_parquet_with_row_group_size(self, tmp_path):
+    def test_write_parquet_with_row_group_size(self, tmp_path, run_script):
         """Test Parquet write with custom row group size."""
         output_file = tmp_path / "custom_rg.parquet"
         req = {
@@ -85,7 +77,7 @@ class TestWriteParquet:
 class TestWriteCSV:
     """Test CSV file writing."""
 
-    def test_write_csv_basic(self, tmp_path):
+    def test_write_csv_basic(self, tmp_path, run_script):
         """Test basic CSV write."""
         output_file = tmp_path / "output.csv"
         req = {
@@ -106,7 +98,7 @@ class TestWriteCSV:
         assert "1" in content
         assert "test" in content
 
-    def test_write_csv_no_header(self, tmp_path):
+    def test_write_csv_no_header(self, tmp_path, run_script):
         """Test CSV write without header."""
         output_file = tmp_path / "no_header.csv"
         req = {
@@ -124,7 +116,7 @@ class TestWriteCSV:
         # Without header, first line should be data
         assert content == '1,test'
 
-    def test_write_csv_custom_delimiter(self, tmp_path):
+    def test_write_csv_custom_delimiter(self, tmp_path, run_script):
         """Test CSV write with custom delimiter."""
         output_file = tmp_path / "tab_delimited.csv"
         req = {
@@ -145,7 +137,7 @@ class TestWriteCSV:
 class TestWriteJSON:
     """Test JSON file writing."""
 
-    def test_write_json_array(self, tmp_path):
+    def test_write_json_array(self, tmp_path, run_script):
         """Test JSON array format write."""
         output_file = tmp_path / "output.json"
         req = {
@@ -166,7 +158,7 @@ class TestWriteJSON:
         assert content[0]["id"] == 1
         assert content[0]["msg"] == "hello"
 
-    def test_write_ndjson(self, tmp_path):
+    def test_write_ndjson(self, tmp_path, run_script):
         """Test newline-delimited JSON format write."""
         output_file = tmp_path / "output.ndjson"
         req = {
@@ -189,7 +181,7 @@ class TestWriteJSON:
 class TestOverwriteProtection:
     """Test overwrite protection behavior."""
 
-    def test_overwrite_protection_default(self, tmp_path):
+    def test_overwrite_protection_default(self, tmp_path, run_script):
         """Test that overwrite is prevented by default."""
         output_file = tmp_path / "exists.parquet"
         
@@ -209,7 +201,7 @@ class TestOverwriteProtection:
         assert result2.get("success") is False
         assert "overwrite" in result2.get("error", "").lower() or "exists" in result2.get("error", "").lower()
 
-    def test_overwrite_allowed_when_enabled(self, tmp_path):
+    def test_overwrite_allowed_when_enabled(self, tmp_path, run_script):
         """Test that overwrite succeeds when enabled."""
         output_file = tmp_path / "overwrite_me.parquet"
         
@@ -234,7 +226,7 @@ class TestOverwriteProtection:
 class TestPartitionedWrite:
     """Test partitioned write functionality."""
 
-    def test_partition_by_single_column(self, tmp_path):
+    def test_partition_by_single_column(self, tmp_path, run_script):
         """Test partitioning by a single column."""
         output_dir = tmp_path / "partitioned"
         req = {
@@ -256,7 +248,7 @@ class TestPartitionedWrite:
         # Should have partition directories
         assert (output_dir / "category=A").exists() or any("category=A" in str(p) for p in output_dir.rglob("*"))
 
-    def test_partition_metadata_returned(self, tmp_path):
+    def test_partition_metadata_returned(self, tmp_path, run_script):
         """Test that partition info is returned in result."""
         output_dir = tmp_path / "partitioned2"
         req = {
@@ -277,11 +269,65 @@ class TestPartitionedWrite:
         # Should have file count and total size for partitioned output
         assert "file_count" in result or "total_size_bytes" in result
 
+    def test_directory_target_writes_per_thread_files(self, tmp_path, run_script):
+        """Test that a directory path without partitioning is written per thread."""
+        output_dir = tmp_path / "chunks"
+        req = {
+            "query": "SELECT range AS id FROM range(1000)",
+            "output": {"path": f"{output_dir}/", "format": "parquet"},
+        }
+        result = run_script(req)
+
+        assert result.get("success") is True
+        assert output_dir.is_dir()
+        assert result["files_created"]
+        assert all(f.endswith(".parquet") for f in result["files_created"])
+        assert result["rows_written"] == 1000
+
+    def test_compressed_directory_target_lists_files(self, tmp_path, run_script):
+        """Test compressed per-thread files are reported with their sizes."""
+        output_dir = tmp_path / "csv_chunks"
+        req = {
+            "query": "SELECT range AS id FROM range(1000)",
+            "output": {
+                "path": f"{output_dir}/",
+                "format": "csv",
+                "options": {"compression": "gzip"},
+            },
+        }
+        result = run_script(req)
+
+        assert result.get("success") is True
+        assert result["files_created"]
+        assert all(f.endswith(".csv.gz") for f in result["files_created"])
+        assert result["total_size_bytes"] > 0
+
+    def test_overwrite_directory_target_clears_stale_files(self, tmp_path, run_script):
+        """Test overwriting a per-thread directory removes files from a prior run."""
+        output_dir = tmp_path / "chunks"
+        output_dir.mkdir()
+        stale = output_dir / "data_99.csv"
+        stale.write_text("id\n-1\n")
+        req = {
+            "query": "SELECT range AS id FROM range(10)",
+            "output": {
+                "path": f"{output_dir}/",
+                "format": "csv",
+                "options": {"overwrite": True},
+            },
+        }
+        result = run_script(req)
+
+        assert result.get("success") is True
+        assert not stale.exists()
+        assert str(stale) not in result["files_created"]
+        assert result["rows_written"] == 10
+
 
 class TestWriteWithSources:
     """Test writing data from sources."""
 
-    def test_write_from_csv_source(self, tmp_path):
+    def test_write_from_csv_source(self, tmp_path, run_script):
         """Test reading from CSV and writing to Parquet."""
         # Create input CSV
         input_csv = tmp_path / "input.csv"
@@ -303,7 +349,7 @@ class TestWriteWithSources:
         assert result.get("success") is True
         assert output_file.exists()
 
-    def test_write_transformed_data(self, tmp_path):
+    def test_write_transformed_data(self, tmp_path, run_script):
         """Test applying transformation and writing."""
         input_csv = tmp_path / "sales.csv"
         input_csv.write_text("region,amount\nNorth,100\nSouth,200\nNorth,150\n")
@@ -333,7 +379,7 @@ class TestWriteWithSources:
 class TestWriteErrorHandling:
     """Test error handling for write operations."""
 
-    def test_invalid_output_path(self, tmp_path):
+    def test_invalid_output_path(self, tmp_path, run_script):
         """Test error when output path is invalid."""
         req = {
             "query": "SELECT 1",
@@ -347,7 +393,7 @@ class TestWriteErrorHandling:
         # Should return an error
         assert result.get("success") is False or result.get("error") is not None
 
-    def test_invalid_format(self, tmp_path):
+    def test_invalid_format(self, tmp_path, run_script):
         """Test error when format is invalid."""
         output_file = tmp_path / "output.xyz"
         req = {
@@ -362,7 +408,7 @@ class TestWriteErrorHandling:
         # Should return an error about invalid format
         assert "error" in result or result.get("success") is False
 
-    def test_query_error_during_write(self, tmp_path):
+    def test_query_error_during_write(self, tmp_path, run_script):
         """Test that query errors are properly reported."""
         output_file = tmp_path / "output.parquet"
         req = {